@@ -0,0 +1,151 @@
+"""
+Compare the int8 classifier against fp32 on a held-out CSV before enabling
+IBTIKAR_QUANTIZE=int8 (or a model.int8.onnx) in ibtikar_api.py.
+
+    python evaluate_quantized.py heldout.csv
+    python evaluate_quantized.py heldout.csv --onnx arabert_toxic_classifier/model.int8.onnx
+    python evaluate_quantized.py heldout.csv --text-col text --label-col Label --limit 2000
+
+Labels are 0 = safe, 1 = harmful (as in the training data). Texts are fed
+exactly as /predict receives them. Reports accuracy, precision, recall and F1
+(harmful class) for both models, their deltas, agreement, latency and model size.
+"""
+import argparse
+import copy
+import csv
+import io
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+MODEL_DIR = Path(__file__).parent / "arabert_toxic_classifier"
+
+
+def load_csv(path: str, text_col: str, label_col: str, limit: int) -> Tuple[List[str], List[int]]:
+    texts, labels = [], []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            text = (row.get(text_col) or "").strip()
+            if not text:
+                continue
+            texts.append(text)
+            labels.append(int(float(row[label_col])))
+            if limit and len(texts) >= limit:
+                break
+    return texts, labels
+
+
+def toxic_index_of(model) -> int:
+    for i, name in (model.config.id2label or {}).items():
+        if "toxic" in str(name).lower():
+            return int(i)
+    return 1
+
+
+def torch_scorer(model, tokenizer) -> Callable[[List[str]], np.ndarray]:
+    def score(texts: List[str]) -> np.ndarray:
+        enc = tokenizer(texts, padding=True, truncation=True, max_length=128, return_tensors="pt")
+        with torch.no_grad():
+            return model(**enc).logits.softmax(dim=-1).numpy()
+    return score
+
+
+def onnx_scorer(path: str, tokenizer) -> Callable[[List[str]], np.ndarray]:
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    names = {i.name for i in session.get_inputs()}
+
+    def score(texts: List[str]) -> np.ndarray:
+        enc = tokenizer(texts, padding=True, truncation=True, max_length=128, return_tensors="np")
+        logits = session.run(None, {k: v.astype(np.int64) for k, v in enc.items() if k in names})[0]
+        e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return e / e.sum(axis=-1, keepdims=True)
+    return score
+
+
+def run(score, texts: List[str], batch_size: int, toxic_index: int) -> Tuple[np.ndarray, float]:
+    """Harmful predictions (0/1) and mean latency in ms per text."""
+    preds = []
+    started = time.perf_counter()
+    for k in range(0, len(texts), batch_size):
+        probs = score(texts[k:k + batch_size])
+        preds.extend((probs[:, toxic_index] >= 0.5).astype(int))
+    elapsed = time.perf_counter() - started
+    return np.array(preds), elapsed / max(1, len(texts)) * 1000.0
+
+
+def metrics(preds: np.ndarray, labels: np.ndarray) -> Dict[str, float]:
+    tp = int(((preds == 1) & (labels == 1)).sum())
+    fp = int(((preds == 1) & (labels == 0)).sum())
+    fn = int(((preds == 0) & (labels == 1)).sum())
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "accuracy": float((preds == labels).mean()),
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+
+def state_dict_mb(model) -> float:
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell() / 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", help="held-out CSV with a text and a 0/1 label column")
+    parser.add_argument("--model", default=str(MODEL_DIR), help="fp32 model directory or HF model id")
+    parser.add_argument("--onnx", help="evaluate this quantized .onnx instead of torch dynamic int8")
+    parser.add_argument("--text-col", default="text")
+    parser.add_argument("--label-col", default="Label")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=0, help="only the first N rows (0 = all)")
+    args = parser.parse_args()
+
+    texts, labels = load_csv(args.csv, args.text_col, args.label_col, args.limit)
+    if not texts:
+        print(f"❌ No rows with a {args.text_col!r} column in {args.csv}")
+        return 1
+    labels = np.array(labels)
+    print(f"📄 {len(texts)} texts, {int(labels.sum())} harmful")
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    fp32 = AutoModelForSequenceClassification.from_pretrained(args.model)
+    fp32.eval()
+    toxic_index = toxic_index_of(fp32)
+
+    if args.onnx:
+        int8_name = f"onnx int8 ({Path(args.onnx).name})"
+        int8_score = onnx_scorer(args.onnx, tokenizer)
+        int8_mb = Path(args.onnx).stat().st_size / 1e6
+    else:
+        int8_name = "torch dynamic int8"
+        int8 = torch.ao.quantization.quantize_dynamic(copy.deepcopy(fp32), {torch.nn.Linear}, dtype=torch.qint8)
+        int8_score = torch_scorer(int8, tokenizer)
+        int8_mb = state_dict_mb(int8)
+
+    fp32_preds, fp32_ms = run(torch_scorer(fp32, tokenizer), texts, args.batch_size, toxic_index)
+    int8_preds, int8_ms = run(int8_score, texts, args.batch_size, toxic_index)
+    m32, m8 = metrics(fp32_preds, labels), metrics(int8_preds, labels)
+
+    print(f"\n{'':<12}{'fp32':>10}{'int8':>10}{'delta':>10}")
+    for key in ("accuracy", "precision", "recall", "f1"):
+        print(f"{key:<12}{m32[key]:>10.4f}{m8[key]:>10.4f}{m8[key] - m32[key]:>+10.4f}")
+    print(f"{'ms / text':<12}{fp32_ms:>10.2f}{int8_ms:>10.2f}{int8_ms / fp32_ms if fp32_ms else 0:>9.2f}x")
+    print(f"{'size MB':<12}{state_dict_mb(fp32):>10.1f}{int8_mb:>10.1f}")
+    print(f"\nint8 model: {int8_name}")
+    print(f"fp32/int8 agree on {float((fp32_preds == int8_preds).mean()) * 100:.2f}% of texts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Export the AraBERT toxicity classifier to ONNX for `IBTIKAR_ENGINE=onnx`,
+then check that ONNX Runtime gives the same probabilities as PyTorch.
+
+    pip install onnx onnxruntime
+    python export_onnx.py                      # -> arabert_toxic_classifier/model.onnx
+    python export_onnx.py --out /tmp/model.onnx --atol 1e-4
+    python export_onnx.py --quantize           # also writes model.int8.onnx (dynamic int8 weights)
+
+Batch and sequence length are dynamic axes, so the exported graph works with
+the length-bucketed batches ibtikar_api.py sends it.
+Exits with status 1 if the parity check fails.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+MODEL_DIR = Path(__file__).parent / "arabert_toxic_classifier"
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+# Mixed lengths on purpose: parity has to hold with padding too.
+SAMPLE_TEXTS = [
+    "مرحبا، كيف حالك اليوم؟",
+    "انت غبي ولا تفهم شيئا",
+    "شكرا جزيلا على المساعدة، الله يعطيك العافية",
+    "هذا الكلام مرفوض تماما ويجب محاسبة كل من يحرض على العنف ضد الناس الأبرياء في كل مكان",
+    "ok",
+    "صباح الخير يا جماعة",
+]
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def export(model, tokenizer, out: Path, opset: int) -> None:
+    enc = tokenizer(SAMPLE_TEXTS[:2], padding=True, return_tensors="pt")
+    names = [n for n in INPUT_NAMES if n in enc]
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    torch.onnx.export(
+        model,
+        tuple(enc[n] for n in names),
+        str(out),
+        input_names=names,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+    print(f"✅ Exported {out} ({out.stat().st_size / 1e6:.1f} MB, inputs: {', '.join(names)})")
+
+
+def quantize(out: Path) -> Path:
+    """Write a dynamic int8 (weights) copy of the exported graph next to it."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    q_out = out.with_name(out.stem + ".int8" + out.suffix)
+    quantize_dynamic(str(out), str(q_out), weight_type=QuantType.QInt8)
+    print(f"✅ Quantized {q_out} ({q_out.stat().st_size / 1e6:.1f} MB)")
+    return q_out
+
+
+def parity(model, tokenizer, out: Path) -> float:
+    """Max absolute difference between PyTorch and ONNX Runtime probabilities."""
+    import onnxruntime as ort
+
+    enc = tokenizer(SAMPLE_TEXTS, padding=True, truncation=True, max_length=128, return_tensors="pt")
+    with torch.no_grad():
+        expected = model(**enc).logits.softmax(dim=-1).numpy()
+
+    session = ort.InferenceSession(str(out), providers=["CPUExecutionProvider"])
+    feeds = {i.name: enc[i.name].numpy().astype(np.int64) for i in session.get_inputs()}
+    got = softmax(session.run(None, feeds)[0])
+    return float(np.abs(expected - got).max())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=str(MODEL_DIR), help="model directory or HF model id")
+    parser.add_argument("--out", default=str(MODEL_DIR / "model.onnx"))
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--atol", type=float, default=1e-4, help="max allowed probability difference")
+    parser.add_argument("--quantize", action="store_true", help="also write a dynamic int8 model.int8.onnx")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForSequenceClassification.from_pretrained(args.model)
+    model.eval()
+
+    out = Path(args.out)
+    export(model, tokenizer, out, args.opset)
+
+    diff = parity(model, tokenizer, out)
+    if diff > args.atol:
+        print(f"❌ Parity check failed: max |torch - onnx| = {diff:.2e} > {args.atol:.0e}")
+        return 1
+    print(f"✅ Parity check passed: max |torch - onnx| = {diff:.2e} (atol {args.atol:.0e})")
+
+    if args.quantize:
+        q_out = quantize(out)
+        # int8 is not expected to match fp32 to atol; judge it with evaluate_quantized.py.
+        print(f"ℹ️ int8 max |torch - onnx| = {parity(model, tokenizer, q_out):.2e} on sample texts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
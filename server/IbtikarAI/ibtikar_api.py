@@ -1,11 +1,25 @@
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, List, NamedTuple
+import asyncio
+import base64
+import json
+import math
 import os
+import sys
+import time
 
-import torch
-from fastapi import FastAPI
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from pydantic import BaseModel
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+try:
+    import msgpack
+except ImportError:  # optional: compact wire format for /predict
+    msgpack = None
+from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
 
 app = FastAPI(title="IbtikarAI Toxicity API")
 
@@ -15,6 +29,53 @@ class TextsIn(BaseModel):
     texts: List[str]
 
 
+# /predict wire formats besides plain JSON {"preds": [...]}, picked from Accept /
+# Content-Type. Both are columnar: a labels array plus scores as a little-endian
+# float32 buffer (raw bytes in msgpack, base64 in JSON).
+MSGPACK = "application/msgpack"
+COLUMNAR_JSON = "application/vnd.ibtikar.columnar+json"
+
+
+def _media_type(header: str) -> str:
+    return header.split(";", 1)[0].strip().lower()
+
+
+async def read_texts(request: Request) -> List[str]:
+    """{"texts": [...]} from a JSON or msgpack body, without pydantic validation."""
+    body = await request.body()
+    try:
+        if _media_type(request.headers.get("content-type", "")) == MSGPACK:
+            if msgpack is None:
+                raise HTTPException(status_code=415, detail="msgpack is not installed on this server")
+            data = msgpack.unpackb(body, raw=False)
+        else:
+            data = json.loads(body)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="Malformed request body")
+    texts = data.get("texts") if isinstance(data, dict) else None
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        raise HTTPException(status_code=422, detail='Expected {"texts": [str, ...]}')
+    return texts
+
+
+def encode_preds(preds: List[dict], accept: str):
+    """Response body in the most compact format the caller accepts."""
+    accept = accept.lower()
+    if (msgpack is not None and MSGPACK in accept) or COLUMNAR_JSON in accept:
+        scores = array("f", (p["score"] for p in preds))
+        if sys.byteorder == "big":
+            scores.byteswap()
+        labels = [p["label"] for p in preds]
+        if msgpack is not None and MSGPACK in accept:
+            body = msgpack.packb({"labels": labels, "scores": scores.tobytes()}, use_bin_type=True)
+            return Response(content=body, media_type=MSGPACK)
+        body = json.dumps({"labels": labels, "scores": base64.b64encode(scores.tobytes()).decode("ascii")})
+        return Response(content=body, media_type=COLUMNAR_JSON)
+    return {"preds": preds}
+
+
 def is_lfs_pointer(file_path: Path) -> bool:
     try:
         with open(file_path, "rb") as f:
@@ -48,12 +109,44 @@ else:
     # You can override via environment variable HF_MODEL_ID
     model_source = os.getenv("HF_MODEL_ID", "unitary/toxic-bert")
 
+# Inference engine: "torch" (eager PyTorch) or "onnx" (ONNX Runtime on a graph
+# exported with export_onnx.py; torch is not needed at runtime then).
+ENGINE = os.getenv("IBTIKAR_ENGINE", "torch").strip().lower()
+ONNX_PATH = os.getenv("IBTIKAR_ONNX_PATH", str(LOCAL_MODEL_DIR / "model.onnx"))
+# "int8" = dynamic int8 quantization of the Linear layers at load (torch engine, CPU).
+# For ONNX, point IBTIKAR_ONNX_PATH at model.int8.onnx from `export_onnx.py --quantize`.
+# Compare accuracy against fp32 with evaluate_quantized.py before turning it on.
+QUANTIZE = os.getenv("IBTIKAR_QUANTIZE", "").strip().lower()
+
 tokenizer = AutoTokenizer.from_pretrained(model_source)
-model = AutoModelForSequenceClassification.from_pretrained(model_source)
-model.eval()  # disable dropout etc.
+if ENGINE == "onnx":
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(ONNX_PATH, providers=["CPUExecutionProvider"])
+    onnx_inputs = {i.name for i in session.get_inputs()}
+    model_config = AutoConfig.from_pretrained(model_source)
+    print(f"🧠 ONNX Runtime engine: {ONNX_PATH}")
+    if QUANTIZE:
+        print("ℹ️ IBTIKAR_QUANTIZE only applies to the torch engine; use a quantized IBTIKAR_ONNX_PATH")
+        QUANTIZE = ""
+else:
+    if ENGINE != "torch":
+        print(f"⚠️ Unknown IBTIKAR_ENGINE={ENGINE!r}, using torch")
+        ENGINE = "torch"
+    import torch
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_source)
+    model.eval()  # disable dropout etc.
+    model_config = model.config
+    if QUANTIZE == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        print("🗜️ Dynamic int8 quantization applied to Linear layers")
+    elif QUANTIZE:
+        print(f"⚠️ Unknown IBTIKAR_QUANTIZE={QUANTIZE!r}, serving fp32")
+        QUANTIZE = ""
 
 # Try to find which output index is "toxic"
-id2label = model.config.id2label or {}
+id2label = model_config.id2label or {}
 toxic_index = None
 for i, name in id2label.items():
     if "toxic" in str(name).lower():
@@ -65,33 +158,315 @@ if toxic_index is None:
     toxic_index = 1
 
 
-@app.post("/predict")
-def predict(inp: TextsIn):
+MAX_LENGTH = 128
+
+# Token-length bucket bounds: texts are sorted by length and each bucket is padded
+# only to its own longest text, so short tweets don't pay for long ones.
+# Empty = pad the whole batch together.
+LENGTH_BUCKETS = sorted(
+    int(b) for b in os.getenv("IBTIKAR_LENGTH_BUCKETS", "16,32,64").split(",") if b.strip()
+)
+
+# Real vs padded token positions fed to the model (see /metrics).
+padding_stats = {"real_tokens": 0, "padded_tokens": 0}
+
+
+def length_buckets(lengths: List[int]) -> List[List[int]]:
+    """Indices grouped by LENGTH_BUCKETS bound, shortest first (input order if no buckets)."""
+    if not LENGTH_BUCKETS:
+        return [list(range(len(lengths)))]
+    buckets: List[List[int]] = []
+    bound = None
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        b = next((x for x in LENGTH_BUCKETS if lengths[i] <= x), None)
+        if not buckets or b != bound:
+            buckets.append([])
+            bound = b
+        buckets[-1].append(i)
+    return buckets
+
+
+def _torch_probs(features: Dict[str, list]) -> List[List[float]]:
+    batch = tokenizer.pad(features, padding=True, return_tensors="pt")
+    with torch.no_grad():
+        outputs = model(**batch)
+        return outputs.logits.softmax(dim=-1).cpu().tolist()
+
+
+def _onnx_probs(features: Dict[str, list]) -> List[List[float]]:
+    batch = tokenizer.pad(features, padding=True, return_tensors="np")
+    feeds = {k: v.astype(np.int64) for k, v in batch.items() if k in onnx_inputs}
+    logits = session.run(None, feeds)[0]
+    e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return (e / e.sum(axis=-1, keepdims=True)).tolist()
+
+
+forward_probs = _onnx_probs if ENGINE == "onnx" else _torch_probs
+
+
+def run_model(texts: List[str], deadlines: List[float | None] | None = None) -> List[dict | None]:
+    """
+    Forward passes over texts, one per length bucket; blocking, runs on the model thread.
+    With deadlines (perf_counter, per text), texts whose deadline has passed by the
+    time their bucket comes up are skipped and get None.
+    """
+    enc = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+    lengths = [len(ids) for ids in enc["input_ids"]]
+
+    preds: List[dict | None] = [None] * len(texts)
+    for idx in length_buckets(lengths):
+        if deadlines is not None:
+            now = time.perf_counter()
+            live = [i for i in idx if deadlines[i] is None or deadlines[i] > now]
+            dropped["expired_mid_batch"] += len(idx) - len(live)
+            idx = live
+            if not idx:
+                continue
+        probs = forward_probs({k: [enc[k][i] for i in idx] for k in enc.keys()})
+        padding_stats["real_tokens"] += sum(lengths[i] for i in idx)
+        padding_stats["padded_tokens"] += len(idx) * max(lengths[i] for i in idx)
+
+        for i, p in zip(idx, probs):
+            toxic_prob = float(p[toxic_index])
+            label = "harmful" if toxic_prob >= 0.5 else "safe"
+            preds[i] = {"label": label, "score": toxic_prob}
+    return preds
+
+
+# ---------- Dynamic batching ----------
+# Texts from concurrent /predict calls are queued and run as one forward:
+# a batch starts once MAX_BATCH texts are waiting or the oldest has waited MAX_WAIT_MS.
+
+MAX_BATCH = int(os.getenv("IBTIKAR_MAX_BATCH", "32"))
+MAX_WAIT_MS = float(os.getenv("IBTIKAR_MAX_WAIT_MS", "5"))
+# Texts allowed to wait for a forward; beyond that /predict answers 503 + Retry-After.
+MAX_QUEUE = int(os.getenv("IBTIKAR_MAX_QUEUE", "512"))
+
+
+class Histogram:
+    """Counts of observed values per bucket (upper bounds), plus +Inf."""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = sorted(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> Dict:
+        buckets = {f"le_{b:g}": c for b, c in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+        }
+
+
+batch_size_hist = Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+queue_ms_hist = Histogram([1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500])
+forward_ms_hist = Histogram([5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000])
+
+# Totals for this process (one pre-fork worker, see serve_prefork.py).
+served = {"requests": 0, "texts": 0}
+# Texts not run: rejected because the queue was full, or their caller's deadline passed.
+dropped = {"queue_full": 0, "expired_on_arrival": 0, "expired_in_queue": 0, "expired_mid_batch": 0}
+# Texts computed but finished after their caller's deadline (wasted work).
+finished_late = {"texts": 0}
+
+
+class DeadlineExpired(Exception):
+    pass
+
+
+class _Item(NamedTuple):
+    text: str
+    fut: asyncio.Future
+    queued_at: float  # perf_counter
+    deadline: float | None  # perf_counter, None = no deadline
+
+
+_pending: List[_Item] = []
+_has_work: asyncio.Event | None = None
+_batch_full: asyncio.Event | None = None  # set once MAX_BATCH texts are waiting
+_batch_task: asyncio.Task | None = None
+# torch already uses intra-op threads; one forward at a time keeps them from contending.
+_model_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ibtikar-forward")
+
+
+async def _batch_worker() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await _has_work.wait()
+        # Give concurrent requests up to MAX_WAIT_MS (from the oldest text) to join,
+        # but go as soon as MAX_BATCH texts are waiting.
+        wait = MAX_WAIT_MS / 1000.0 - (time.perf_counter() - _pending[0].queued_at)
+        if len(_pending) < MAX_BATCH and wait > 0:
+            _batch_full.clear()
+            try:
+                await asyncio.wait_for(_batch_full.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+        taken = _pending[:MAX_BATCH]
+        del _pending[:MAX_BATCH]
+        if not _pending:
+            _has_work.clear()
+
+        # Nobody is waiting for texts past their caller's deadline: don't compute them.
+        started = time.perf_counter()
+        batch = []
+        for item in taken:
+            if item.fut.done():
+                continue
+            if item.deadline is not None and started >= item.deadline:
+                dropped["expired_in_queue"] += 1
+                item.fut.set_exception(DeadlineExpired())
+                continue
+            batch.append(item)
+        if not batch:
+            continue
+
+        for item in batch:
+            queue_ms_hist.observe((started - item.queued_at) * 1000.0)
+        batch_size_hist.observe(len(batch))
+        try:
+            preds = await loop.run_in_executor(
+                _model_executor, run_model, [item.text for item in batch], [item.deadline for item in batch]
+            )
+        except Exception as e:
+            print(f"❌ Forward over {len(batch)} texts failed: {e}")
+            for item in batch:
+                if not item.fut.done():
+                    item.fut.set_exception(e)
+            continue
+        finished = time.perf_counter()
+        forward_ms_hist.observe((finished - started) * 1000.0)
+        for item, pred in zip(batch, preds):
+            if pred is not None and item.deadline is not None and finished > item.deadline:
+                finished_late["texts"] += 1
+            if item.fut.done():
+                continue
+            if pred is None:
+                item.fut.set_exception(DeadlineExpired())
+            else:
+                item.fut.set_result(pred)
+
+
+@app.on_event("startup")
+async def _start_batcher():
+    global _has_work, _batch_full, _batch_task
+    _has_work = asyncio.Event()
+    _batch_full = asyncio.Event()
+    _batch_task = asyncio.create_task(_batch_worker())
+
+
+@app.on_event("shutdown")
+async def _stop_batcher():
+    if _batch_task is not None:
+        _batch_task.cancel()
+    _model_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _retry_after(queued: int) -> int:
+    """Seconds until `queued` texts should have drained, from recent forward throughput."""
+    if not forward_ms_hist.total:
+        return 1
+    texts_per_sec = batch_size_hist.total / (forward_ms_hist.total / 1000.0)
+    return max(1, math.ceil(queued / texts_per_sec))
+
+
+@app.post(
+    "/predict",
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": TextsIn.model_json_schema()},
+        MSGPACK: {"schema": TextsIn.model_json_schema()},
+    }}},
+)
+async def predict(request: Request, x_ibtikar_deadline: float | None = Header(None)):
     """
     Input:  { "texts": ["...", "..."] }
     Output: { "preds": [ {"label": "harmful"/"safe", "score": float}, ... ] }
+
+    With `Accept: application/msgpack` (if msgpack is installed) or
+    `application/vnd.ibtikar.columnar+json` the output is columnar instead:
+    { "labels": [...], "scores": <little-endian float32 buffer> }.
+    The request body may be msgpack too (Content-Type: application/msgpack).
+
+    Optional header X-Ibtikar-Deadline: unix time (seconds) after which the caller
+    no longer wants the answer; such work is dropped and answered with 504.
+    When IBTIKAR_MAX_QUEUE texts are already waiting, answers 503 with Retry-After.
     """
 
-    if not inp.texts:
-        return {"preds": []}
+    texts = await read_texts(request)
+    accept = request.headers.get("accept", "")
+    if not texts:
+        return encode_preds([], accept)
 
-    enc = tokenizer(
-        inp.texts,
-        padding=True,
-        truncation=True,
-        max_length=128,
-        return_tensors="pt",
-    )
+    n = len(texts)
+    now = time.perf_counter()
+    deadline = None
+    if x_ibtikar_deadline is not None:
+        deadline = now + (x_ibtikar_deadline - time.time())
+        if deadline <= now:
+            dropped["expired_on_arrival"] += n
+            raise HTTPException(status_code=504, detail="Deadline already passed")
+    if n > MAX_QUEUE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_QUEUE} texts per request")
+    if len(_pending) + n > MAX_QUEUE:
+        dropped["queue_full"] += n
+        raise HTTPException(
+            status_code=503,
+            detail="Inference queue full",
+            headers={"Retry-After": str(_retry_after(len(_pending) + n))},
+        )
 
-    with torch.no_grad():
-        outputs = model(**enc)
-        probs = outputs.logits.softmax(dim=-1)
+    loop = asyncio.get_running_loop()
+    futures = []
+    for text in texts:
+        fut = loop.create_future()
+        _pending.append(_Item(text, fut, now, deadline))
+        futures.append(fut)
+    _has_work.set()
+    if len(_pending) >= MAX_BATCH:
+        _batch_full.set()
 
-    preds = []
-    for p in probs:
-        p = p.cpu()
-        toxic_prob = float(p[toxic_index])
-        label = "harmful" if toxic_prob >= 0.5 else "safe"
-        preds.append({"label": label, "score": toxic_prob})
+    preds = await asyncio.gather(*futures, return_exceptions=True)
+    if any(isinstance(p, DeadlineExpired) for p in preds):
+        raise HTTPException(status_code=504, detail="Deadline passed while queued")
+    for p in preds:
+        if isinstance(p, BaseException):
+            raise p
+    served["requests"] += 1
+    served["texts"] += len(preds)
+    return encode_preds(list(preds), accept)
 
-    return {"preds": preds}
+
+@app.get("/metrics")
+def metrics():
+    """Batching stats: texts per forward, time texts waited in the queue, forward time."""
+    return {
+        "pid": os.getpid(),
+        "served": served,
+        "engine": ENGINE,
+        "quantize": QUANTIZE or None,
+        "max_batch": MAX_BATCH,
+        "max_wait_ms": MAX_WAIT_MS,
+        "length_buckets": LENGTH_BUCKETS,
+        "queue_depth": len(_pending),
+        "max_queue": MAX_QUEUE,
+        "dropped": dropped,
+        "finished_after_deadline": finished_late["texts"],
+        "padding": {
+            **padding_stats,
+            "efficiency": round(padding_stats["real_tokens"] / padding_stats["padded_tokens"], 3)
+            if padding_stats["padded_tokens"] else 1.0,
+        },
+        "batch_size": batch_size_hist.snapshot(),
+        "queue_ms": queue_ms_hist.snapshot(),
+        "forward_ms": forward_ms_hist.snapshot(),
+    }
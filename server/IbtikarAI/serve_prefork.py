@@ -0,0 +1,174 @@
+"""
+Pre-fork launcher for ibtikar_api: load the tokenizer and model once in this
+process, then fork workers that share the weights copy-on-write and serve
+/predict from one listening socket.
+
+    python serve_prefork.py --workers 4 --port 9000
+    python serve_prefork.py --workers 4 --threads-per-worker 2 --report-every 30
+
+Each worker pins torch to --threads-per-worker intra-op threads (default:
+CPU cores / workers) so workers don't oversubscribe cores. Every
+--report-every seconds this process prints each worker's RSS, PSS (its fair
+share once shared pages are split between workers) and texts per second.
+A worker that dies is re-forked from the already loaded model.
+
+POSIX only (fork). Torch engine only: ONNX Runtime's thread pool does not
+survive fork, so run the onnx engine with `uvicorn --workers` instead.
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict
+
+DEFAULT_PORT = 9000
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=0, help="torch intra-op threads (0 = cores / workers)")
+    parser.add_argument("--report-every", type=float, default=60.0, help="seconds between worker reports (0 = off)")
+    return parser.parse_args()
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    """Rss / Pss / shared pages of a process in kB (Linux; empty elsewhere)."""
+    out: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                    out[key] = int(rest.split()[0])
+    except (OSError, ValueError):
+        pass
+    return out
+
+
+def run_worker(slot: int, sock: socket.socket, threads: int, counters) -> None:
+    """Body of a forked worker; never returns."""
+    import torch
+    import uvicorn
+
+    import ibtikar_api
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+
+    def _publish() -> None:
+        # Texts served so far, for the parent's throughput report.
+        while True:
+            counters[slot] = ibtikar_api.served["texts"]
+            time.sleep(1.0)
+
+    threading.Thread(target=_publish, daemon=True).start()
+    print(f"👷 Worker {slot} (pid {os.getpid()}) serving with {threads} torch threads")
+    config = uvicorn.Config(ibtikar_api.app, log_level="warning", access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+    os._exit(0)
+
+
+def main() -> int:
+    args = parse_args()
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    # Load once, before forking. No forward pass runs here: torch's thread pool
+    # must start inside each worker, not be inherited half-initialized.
+    import ibtikar_api
+
+    if ibtikar_api.ENGINE != "torch":
+        print(f"❌ serve_prefork.py needs IBTIKAR_ENGINE=torch (got {ibtikar_api.ENGINE!r})")
+        return 1
+    # Keep the loaded objects out of the cyclic GC so collections in workers
+    # don't write to (and un-share) their pages.
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    counters = multiprocessing.RawArray("q", workers)
+    children: Dict[int, int] = {}  # pid -> slot
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        counters[slot] = 0
+        pid = os.fork()
+        if pid == 0:
+            run_worker(slot, sock, threads, counters)
+        children[pid] = slot
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    parent = memory_kb(os.getpid())
+    print(
+        f"🚀 Model loaded once (parent RSS {parent.get('Rss', 0) / 1024:.0f} MB); "
+        f"forking {workers} workers on {args.host}:{args.port}"
+    )
+    for slot in range(workers):
+        spawn(slot)
+
+    # Single-threaded supervisor loop: reap/re-fork workers and report.
+    last_report = time.monotonic()
+    last_texts = [0] * workers
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            slot = children.pop(pid)
+            if not stopping:
+                print(f"⚠️ Worker {slot} (pid {pid}) exited with status {status}, re-forking")
+                last_texts[slot] = 0
+                spawn(slot)
+            continue
+
+        now = time.monotonic()
+        if args.report_every > 0 and now - last_report >= args.report_every and not stopping:
+            elapsed = now - last_report
+            print(f"📊 Workers ({threads} torch threads each):")
+            for wpid, slot in sorted(children.items(), key=lambda kv: kv[1]):
+                mem = memory_kb(wpid)
+                texts = counters[slot]
+                rate = (texts - last_texts[slot]) / elapsed
+                last_texts[slot] = texts
+                shared = mem.get("Shared_Clean", 0) + mem.get("Shared_Dirty", 0)
+                print(
+                    f"  worker {slot} pid={wpid} rss={mem.get('Rss', 0) / 1024:.0f}MB "
+                    f"pss={mem.get('Pss', 0) / 1024:.0f}MB shared={shared / 1024:.0f}MB "
+                    f"texts={texts} ({rate:.1f}/s)"
+                )
+            last_report = now
+        time.sleep(0.5)
+
+    sock.close()
+    print("👋 All workers stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,36 @@
 from datetime import datetime
+import json
 import time
 import os
 from pathlib import Path
 
 from fastapi import FastAPI, Depends, HTTPException, Query, Request
-from fastapi.responses import RedirectResponse, HTMLResponse, FileResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, case
 
 from ..core.config import settings
 from ..db.init_db import init_db
-from ..db.session import get_db
+from ..db.session import get_db, SessionLocal
 from ..db import models
 from ..core.crypto import enc
 from ..core.memory import new_state, put_state, pop_state
+from ..core.jobs import JobQueue
 from ..clients.x_client import generate_pkce, build_auth_url, exchange_code_for_token
 from ..core.schemas import AnalysisResponse, AnalysisItem
 from ..core.normalize import x_tweets_to_posts
-from ..clients.ibtikar_client import analyze_texts
+from ..clients.ibtikar_client import (
+    analyze_texts,
+    iter_analyze_texts,
+    get_inference_stats,
+    startup_inference,
+    shutdown_inference,
+)
 from ..db.models import Prediction
 from ..clients.x_api import get_me, get_my_recent_tweets, get_following_feed
 
 from typing import List, Optional
+import uuid
 from pydantic import BaseModel
 
 # ---------- Analysis schemas ----------
@@ -61,11 +70,41 @@ class AuthorSummaryResponse(BaseModel):
     total: int
     items: List[AuthorSummaryItem]
 
+
+class AnalysisJobResponse(BaseModel):
+    id: str
+    user_id: int
+    status: str
+    total: Optional[int] = None
+    processed: int = 0
+    harmful_count: int = 0
+    safe_count: int = 0
+    unknown_count: int = 0
+    error: Optional[str] = None
+    fetch_ms: Optional[int] = None
+    analyze_ms: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # ---------- FastAPI app and endpoints ----------
 
 app = FastAPI(title="IbtikarAI Backend", version="0.2.0")
 init_db()  # create tables on startup (local dev)
 
+
+@app.on_event("startup")
+async def _startup():
+    await startup_inference()
+    job_queue.start()
+    _requeue_unfinished_jobs()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await job_queue.stop()
+    await shutdown_inference()
+
 # ---------- Analysis read endpoints ----------
 
 @app.get("/v1/analysis/posts", response_model=AnalysisPostsResponse)
@@ -215,6 +254,8 @@ def health():
         "service": "ibtikar-backend",
         "env": settings.ENV,
         "version": "0.2.0",
+        "inference": get_inference_stats(),
+        "jobs": job_queue.stats(),
     }
 
 
@@ -662,6 +703,13 @@ async def x_feed_normalized(
     raw = await get_following_feed(
         user_id, db, authors_limit=authors_limit, per_batch=per_batch
     )
+    _raise_if_rate_limited(raw)
+
+    return {"items": [p.dict() for p in x_tweets_to_posts(raw)]}
+
+
+def _raise_if_rate_limited(raw) -> None:
+    """Turn X's rate-limit marker from get_following_feed into a 429."""
     if isinstance(raw, dict) and raw.get("rate_limited"):
         reset = raw.get("reset")
         try:
@@ -684,7 +732,82 @@ async def x_feed_normalized(
             },
         )
 
-    return {"items": [p.dict() for p in x_tweets_to_posts(raw)]}
+
+def _upsert_prediction(db: Session, user_id: int, p, label: str, score: float) -> None:
+    """Insert or update the (user, "x", post_id) prediction; the caller commits."""
+    # Key we use to avoid duplicates
+    post_id_str = str(p.post_id) if getattr(p, "post_id", None) is not None else None
+
+    # Check if a prediction for this (user, source, post_id) already exists
+    existing_pred = (
+        db.query(Prediction)
+        .filter(
+            Prediction.user_id == user_id,
+            Prediction.source == "x",
+            Prediction.post_id == post_id_str,
+        )
+        .first()
+    )
+
+    if existing_pred:
+        # Update existing prediction instead of inserting a duplicate
+        existing_pred.author_id = (
+            str(p.author_id) if getattr(p, "author_id", None) else None
+        )
+        existing_pred.lang = getattr(p, "lang", None)
+        existing_pred.text = p.text
+        existing_pred.label = label
+        existing_pred.score = score
+        existing_pred.post_created_at = (
+            p.created_at if isinstance(p.created_at, datetime) else None
+        )
+        existing_pred.created_at = datetime.utcnow()
+    else:
+        # Create a new prediction
+        db_obj = Prediction(
+            user_id=user_id,
+            source="x",
+            post_id=post_id_str,
+            author_id=(
+                str(p.author_id) if getattr(p, "author_id", None) else None
+            ),
+            lang=getattr(p, "lang", None),
+            text=p.text,
+            label=label,
+            score=score,
+            post_created_at=(
+                p.created_at if isinstance(p.created_at, datetime) else None
+            ),
+        )
+        db.add(db_obj)
+
+
+def _apply_late_predictions(user_id: int, posts: list, late: dict) -> None:
+    """Fill in predictions saved as "pending" once their background scoring finishes."""
+    db = SessionLocal()
+    try:
+        updated = 0
+        for idx, pr in late.items():
+            p = posts[idx]
+            pred = (
+                db.query(Prediction)
+                .filter(
+                    Prediction.user_id == user_id,
+                    Prediction.source == "x",
+                    Prediction.post_id == str(p.post_id),
+                    Prediction.label == "pending",
+                )
+                .first()
+            )
+            if pred:
+                pred.label = pr.get("label", "unknown")
+                pred.score = float(pr.get("score", 0.0))
+                pred.created_at = datetime.utcnow()
+                updated += 1
+        db.commit()
+        print(f"⌛ Updated {updated} pending predictions for user_id={user_id}")
+    finally:
+        db.close()
 
 
 @app.post("/v1/analysis/preview", response_model=AnalysisResponse)
@@ -694,30 +817,13 @@ async def analysis_preview(
     per_batch: int = Query(15),
     db: Session = Depends(get_db),
 ):
+    # Overall budget for the request; posts not scored in time come back as "pending".
+    deadline = time.monotonic() + settings.ANALYSIS_PREVIEW_DEADLINE
+
     raw = await get_following_feed(
         user_id, db, authors_limit=authors_limit, per_batch=per_batch
     )
-    if isinstance(raw, dict) and raw.get("rate_limited"):
-        reset = raw.get("reset")
-        try:
-            reset_human = (
-                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(reset)))
-                if reset
-                else None
-            )
-        except Exception:
-            reset_human = None
-        raise HTTPException(
-            status_code=429,
-            detail={
-                "error": "rate_limited",
-                "resource": raw.get("resource"),
-                "reset_epoch": reset,
-                "reset_time": reset_human,
-                "limit": raw.get("limit"),
-                "remaining": raw.get("remaining"),
-            },
-        )
+    _raise_if_rate_limited(raw)
 
     posts = x_tweets_to_posts(raw)
     if not posts:
@@ -725,10 +831,16 @@ async def analysis_preview(
             items=[], harmful_count=0, safe_count=0, unknown_count=0
         )
 
-    preds = await analyze_texts([p.text for p in posts])
+    preds = await analyze_texts(
+        [p.text for p in posts],
+        db=db,
+        deadline=deadline,
+        on_late_results=lambda late: _apply_late_predictions(user_id, posts, late),
+        tenant=user_id,
+    )
 
     items: list[AnalysisItem] = []
-    hc = sc = uc = 0
+    hc = sc = uc = pc = 0
 
     for p, pr in zip(posts, preds):
         label = pr.get("label", "unknown")
@@ -739,54 +851,12 @@ async def analysis_preview(
             hc += 1
         elif label == "safe":
             sc += 1
+        elif label == "pending":
+            pc += 1
         else:
             uc += 1
 
-        # Key we use to avoid duplicates
-        post_id_str = str(p.post_id) if getattr(p, "post_id", None) is not None else None
-
-        # Check if a prediction for this (user, source, post_id) already exists
-        existing_pred = (
-            db.query(Prediction)
-            .filter(
-                Prediction.user_id == user_id,
-                Prediction.source == "x",
-                Prediction.post_id == post_id_str,
-            )
-            .first()
-        )
-
-        if existing_pred:
-            # Update existing prediction instead of inserting a duplicate
-            existing_pred.author_id = (
-                str(p.author_id) if getattr(p, "author_id", None) else None
-            )
-            existing_pred.lang = getattr(p, "lang", None)
-            existing_pred.text = p.text
-            existing_pred.label = label
-            existing_pred.score = score
-            existing_pred.post_created_at = (
-                p.created_at if isinstance(p.created_at, datetime) else None
-            )
-            existing_pred.created_at = datetime.utcnow()
-        else:
-            # Create a new prediction
-            db_obj = Prediction(
-                user_id=user_id,
-                source="x",
-                post_id=post_id_str,
-                author_id=(
-                    str(p.author_id) if getattr(p, "author_id", None) else None
-                ),
-                lang=getattr(p, "lang", None),
-                text=p.text,
-                label=label,
-                score=score,
-                post_created_at=(
-                    p.created_at if isinstance(p.created_at, datetime) else None
-                ),
-            )
-            db.add(db_obj)
+        _upsert_prediction(db, user_id, p, label, score)
 
     # Save all changes (new + updated) at once
     db.commit()
@@ -796,4 +866,234 @@ async def analysis_preview(
         harmful_count=hc,
         safe_count=sc,
         unknown_count=uc,
+        pending_count=pc,
+    )
+
+
+# Commit streamed predictions in groups instead of holding them all until the end.
+STREAM_COMMIT_EVERY = 25
+
+
+@app.post("/v1/analysis/preview/stream")
+async def analysis_preview_stream(
+    user_id: int = Query(1),
+    authors_limit: int = Query(15),
+    per_batch: int = Query(15),
+    db: Session = Depends(get_db),
+):
+    """
+    Same pipeline as /v1/analysis/preview, streamed as NDJSON:
+    one {"type": "item", "index", "item"} line per post as soon as it is classified
+    (cached posts first), then a final {"type": "summary", ...} line.
+    """
+    started = time.monotonic()
+    deadline = started + settings.ANALYSIS_PREVIEW_DEADLINE
+
+    raw = await get_following_feed(
+        user_id, db, authors_limit=authors_limit, per_batch=per_batch
+    )
+    _raise_if_rate_limited(raw)
+    posts = x_tweets_to_posts(raw)
+
+    async def events():
+        # The request's session is closed once the handler returns, so use our own.
+        stream_db = SessionLocal()
+        counts = {"harmful": 0, "safe": 0, "unknown": 0, "pending": 0}
+        try:
+            written = 0
+            async for idx, pr in iter_analyze_texts(
+                [p.text for p in posts],
+                db=stream_db,
+                deadline=deadline,
+                on_late_results=lambda late: _apply_late_predictions(user_id, posts, late),
+                tenant=user_id,
+            ):
+                p = posts[idx]
+                label = pr.get("label", "unknown")
+                score = float(pr.get("score", 0.0))
+                counts[label if label in counts else "unknown"] += 1
+
+                _upsert_prediction(stream_db, user_id, p, label, score)
+                written += 1
+                if written % STREAM_COMMIT_EVERY == 0:
+                    stream_db.commit()
+
+                item = AnalysisItem(post=p, label=label, score=score)
+                yield json.dumps({"type": "item", "index": idx, "item": item.dict()}) + "\n"
+
+            stream_db.commit()
+            yield json.dumps({
+                "type": "summary",
+                "total": len(posts),
+                "harmful_count": counts["harmful"],
+                "safe_count": counts["safe"],
+                "unknown_count": counts["unknown"],
+                "pending_count": counts["pending"],
+                "elapsed_ms": round((time.monotonic() - started) * 1000.0),
+            }) + "\n"
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+# ---------- Background analysis jobs ----------
+
+def _job_response(job: models.AnalysisJob) -> AnalysisJobResponse:
+    return AnalysisJobResponse(
+        id=job.id,
+        user_id=job.user_id,
+        status=job.status,
+        total=job.total,
+        processed=job.processed or 0,
+        harmful_count=job.harmful_count or 0,
+        safe_count=job.safe_count or 0,
+        unknown_count=job.unknown_count or 0,
+        error=job.error,
+        fetch_ms=job.fetch_ms,
+        analyze_ms=job.analyze_ms,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
+
+
+async def _run_analysis_job(job_id: str) -> None:
+    """Fetch -> classify -> persist for one job, recording progress on the job row."""
+    db = SessionLocal()
+    try:
+        job = db.get(models.AnalysisJob, job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        job.processed = job.harmful_count = job.safe_count = job.unknown_count = 0
+        db.commit()
+        print(f"🏃 Job {job_id}: started for user_id={job.user_id}")
+
+        t0 = time.perf_counter()
+        raw = await get_following_feed(
+            job.user_id, db, authors_limit=job.authors_limit, per_batch=job.per_batch
+        )
+        if isinstance(raw, dict) and raw.get("rate_limited"):
+            raise RuntimeError(f"X rate limited ({raw.get('resource')}), reset at {raw.get('reset')}")
+        posts = x_tweets_to_posts(raw)
+        job.fetch_ms = int((time.perf_counter() - t0) * 1000)
+        job.total = len(posts)
+        db.commit()
+
+        t1 = time.perf_counter()
+        counts = {"harmful": 0, "safe": 0, "unknown": 0}
+        async for idx, pr in iter_analyze_texts(
+            [p.text for p in posts], db=db, priority="background", tenant=job.user_id
+        ):
+            label = pr.get("label", "unknown")
+            score = float(pr.get("score", 0.0))
+            counts[label if label in counts else "unknown"] += 1
+            _upsert_prediction(db, job.user_id, posts[idx], label, score)
+            job.processed += 1
+            if job.processed % STREAM_COMMIT_EVERY == 0:
+                job.harmful_count, job.safe_count, job.unknown_count = (
+                    counts["harmful"], counts["safe"], counts["unknown"]
+                )
+                db.commit()
+
+        job.harmful_count, job.safe_count, job.unknown_count = (
+            counts["harmful"], counts["safe"], counts["unknown"]
+        )
+        job.analyze_ms = int((time.perf_counter() - t1) * 1000)
+        job.status = "succeeded"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        print(f"✅ Job {job_id}: {job.processed} posts in {job.fetch_ms + job.analyze_ms} ms")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Job {job_id} failed: {e}")
+        job = db.get(models.AnalysisJob, job_id)
+        if job is not None:
+            job.status = "failed"
+            job.error = str(e)[:1000]
+            job.finished_at = datetime.utcnow()
+            db.commit()
+    finally:
+        db.close()
+
+
+job_queue = JobQueue(
+    _run_analysis_job,
+    workers=settings.JOBS_MAX_WORKERS,
+    max_queued=settings.JOBS_MAX_QUEUED,
+)
+
+
+def _requeue_unfinished_jobs() -> None:
+    """Put jobs that were queued or running when the process stopped back in the queue."""
+    db = SessionLocal()
+    try:
+        jobs = (
+            db.query(models.AnalysisJob)
+            .filter(models.AnalysisJob.status.in_(["queued", "running"]))
+            .order_by(models.AnalysisJob.created_at)
+            .all()
+        )
+        requeued = 0
+        for job in jobs:
+            job.status = "queued"
+            if job_queue.submit(job.id):
+                requeued += 1
+            else:
+                job.status = "failed"
+                job.error = "Job queue full after restart"
+                job.finished_at = datetime.utcnow()
+        db.commit()
+        if jobs:
+            print(f"♻️ Re-queued {requeued} of {len(jobs)} unfinished analysis jobs")
+    finally:
+        db.close()
+
+
+@app.post("/v1/analysis/jobs", response_model=AnalysisJobResponse, status_code=202)
+async def create_analysis_job(
+    user_id: int = Query(1),
+    authors_limit: int = Query(15),
+    per_batch: int = Query(15),
+    db: Session = Depends(get_db),
+):
+    """
+    Queue a fetch -> classify -> persist run and return its id right away.
+    Poll GET /v1/analysis/jobs/{job_id} for progress.
+    """
+    ensure_user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not ensure_user:
+        raise HTTPException(status_code=404, detail=f"Unknown user_id={user_id}")
+
+    job = models.AnalysisJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        status="queued",
+        authors_limit=authors_limit,
+        per_batch=per_batch,
     )
+    db.add(job)
+    db.commit()
+
+    if not job_queue.submit(job.id):
+        job.status = "failed"
+        job.error = "Job queue full"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        raise HTTPException(
+            status_code=429,
+            detail={"error": "job_queue_full", "max_queued": job_queue.max_queued},
+        )
+
+    print(f"📥 Queued analysis job {job.id} for user_id={user_id}")
+    return _job_response(job)
+
+
+@app.get("/v1/analysis/jobs/{job_id}", response_model=AnalysisJobResponse)
+def get_analysis_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(models.AnalysisJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
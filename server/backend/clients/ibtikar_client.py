@@ -1,12 +1,145 @@
-from typing import List, Dict, Any
+import asyncio
+import base64
+import json
+import sys
+import time
+from array import array
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
 
 import httpx
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+try:
+    import msgpack
+except ImportError:  # optional: JSON-only wire format without it
+    msgpack = None
+
 from ..core.config import settings
+from ..core.normalize import text_cache_key
+from ..core.prediction_cache import PredictionCache
+from ..db.models import ScoredText
+from ..db.session import SessionLocal
+from .inference_backends import InferenceBackend, InProcessBackend, Outcome as _Outcome
+from .microbatch import MicroBatcher
+from .resilience import CircuitBreaker, LatencyTracker, hedged
+from .scheduler import BATCH_TENANT, LANES, LaneScheduler, current_lane, current_tenant, lane_of
 
 # When IBTIKAR_URL is not set, use this Space.
 DEFAULT_HF_SPACE_URL = "https://bisharababish-arabert-toxic-classifier.hf.space"
 DEFAULT_HF_SPACE_NAME = "Bisharababish/arabert-toxic-classifier"
 
+# One pooled client per process so keep-alive connections are reused across calls.
+_http_client: httpx.AsyncClient | None = None
+
+# Gradio routes to probe, in order; the first that answers is cached per base URL.
+GRADIO_CALL_ROUTES = ("/call/predict", "/gradio_api/call/predict")
+_active_routes: Dict[str, str] = {}
+_discovery_locks: Dict[str, asyncio.Lock] = {}
+
+# Whether each base URL serves the batch /predict protocol (absent = not probed yet).
+_batch_support: Dict[str, bool] = {}
+
+# Compact /predict wire formats (see ibtikar_api.encode_preds). Requests stay JSON
+# until a server has answered in one of these, so older servers keep working.
+MSGPACK = "application/msgpack"
+COLUMNAR_JSON = "application/vnd.ibtikar.columnar+json"
+PREDICT_ACCEPT = (
+    f"{MSGPACK}, {COLUMNAR_JSON};q=0.9, application/json;q=0.5" if msgpack is not None
+    else f"{COLUMNAR_JSON}, application/json;q=0.5"
+)
+_wire_formats: Dict[str, str] = {}
+
+# Recent predictions by text_cache_key; hits skip the network entirely.
+_prediction_cache = PredictionCache(
+    max_entries=settings.PREDICTION_CACHE_SIZE,
+    ttl_seconds=settings.PREDICTION_CACHE_TTL_SECONDS,
+)
+
+# Cross-request micro-batchers per batch-capable base URL, one per priority lane
+# so background texts never sit in front of interactive ones inside a batch;
+# within a lane, each batch is shared between user_ids (see MicroBatcher).
+_batchers: Dict[str, Dict[str, MicroBatcher]] = {}
+
+# Per base URL: circuit breaker and recent single-call latencies (for hedging).
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyTracker] = {}
+_hedge_stats = {"fired": 0, "won": 0}
+
+# Within-call dedup totals: non-empty texts seen vs unique texts among them.
+_dedup_stats = {"calls": 0, "texts": 0, "unique_texts": 0}
+
+# Single-flight: text_cache_key -> (future shared by every caller scoring that text,
+# lane the work is scheduled in).
+_inflight: Dict[str, Tuple[asyncio.Future, str]] = {}
+_background_tasks: set = set()
+
+# Selected once per process from IBTIKAR_BACKEND (see get_backend).
+_backend: InferenceBackend | None = None
+
+
+def _build_scheduler(slots: int) -> LaneScheduler:
+    return LaneScheduler(
+        slots=slots,
+        weights={
+            "interactive": settings.IBTIKAR_INTERACTIVE_WEIGHT,
+            "background": settings.IBTIKAR_BACKGROUND_WEIGHT,
+        },
+        max_wait=settings.IBTIKAR_LANE_MAX_WAIT,
+        quantum=settings.IBTIKAR_TENANT_QUANTUM,
+        tenant_weights=settings.IBTIKAR_TENANT_WEIGHTS,
+        tenant_max_slots=settings.IBTIKAR_TENANT_MAX_SLOTS,
+    )
+
+
+# Process-wide cap on in-flight Space calls, shared by every analyze_texts caller;
+# free slots go to interactive work before background work, and round-robin
+# between user_ids within a lane (see LaneScheduler).
+_scheduler = _build_scheduler(settings.IBTIKAR_MAX_CONCURRENCY)
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    http2 = settings.IBTIKAR_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("⚠️ IBTIKAR_HTTP2 is set but 'h2' is not installed, using HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        timeout=settings.IBTIKAR_TIMEOUT,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.IBTIKAR_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.IBTIKAR_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.IBTIKAR_HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared client for every inference call; created lazily if startup did not run."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _build_http_client()
+    return _http_client
+
+
+async def startup_http_client() -> None:
+    get_http_client()
+    print(
+        f"🔌 Inference HTTP pool ready (max_connections={settings.IBTIKAR_HTTP_MAX_CONNECTIONS}, "
+        f"keepalive={settings.IBTIKAR_HTTP_MAX_KEEPALIVE}, http2={settings.IBTIKAR_HTTP2})"
+    )
+
+
+async def shutdown_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 def _stub_only_on_failure(texts: List[str]) -> List[Dict]:
     """Only when request actually fails (timeout, connection). Never fake safe."""
@@ -55,102 +188,858 @@ def _parse_single_result(result: Any) -> Dict:
     return {"label": "unknown", "score": 0.0}
 
 
+def _parse_gradio_data(result_data: Any) -> Dict | None:
+    if isinstance(result_data, list) and len(result_data) > 0:
+        return _parse_single_result(result_data[0])
+    if result_data:
+        return _parse_single_result(result_data)
+    return None
+
+
+async def _read_gradio_sse(response: httpx.Response, url: str) -> Dict | None:
+    """
+    Consume a Gradio SSE stream line by line.
+    Returns on the `complete` event, fails fast on `error`, ignores heartbeats.
+    """
+    event = None
+    last_data = None  # untyped "data:" lines, for Spaces that omit "event:"
+    async for line in response.aiter_lines():
+        line = line.strip()
+        if not line:
+            event = None  # blank line terminates an SSE event
+            continue
+        if line.startswith("event:"):
+            event = line[6:].strip()
+            continue
+        if not line.startswith("data:"):
+            continue
+
+        payload = line[5:].strip()
+        if event == "error":
+            print(f"❌ Space reported an error at {url}: {payload[:200]}")
+            return None
+        if event not in (None, "complete") or not payload:
+            continue
+        try:
+            data = json.loads(payload)
+        except json.JSONDecodeError:
+            continue
+        if event == "complete":
+            parsed = _parse_gradio_data(data)
+            if parsed is None:
+                print(f"⚠️ Could not parse complete event from {url}: {payload[:500]}")
+            return parsed
+        last_data = data
+
+    parsed = _parse_gradio_data(last_data)
+    if parsed is None:
+        print(f"⚠️ SSE stream from {url} ended without a result")
+    return parsed
+
+
+# Absolute unix-time deadline sent with each model call; ibtikar_api drops queued
+# work once it has passed instead of computing results nobody will read.
+DEADLINE_HEADER = "X-Ibtikar-Deadline"
+
+
+def _deadline_headers(timeout: float) -> Dict[str, str]:
+    return {DEADLINE_HEADER: f"{time.time() + timeout:.3f}"}
+
+
+class _RouteUnavailable(Exception):
+    """The Space does not serve this Gradio route (404 or no event_id)."""
+
+
+async def _call_gradio_route(url: str, text: str, timeout: float) -> Dict | None:
+    """
+    Call one Gradio 5.x route (two-step: POST <url> -> GET <url>/<event_id>).
+    Returns parsed {label, score}, None on failure, or raises _RouteUnavailable.
+    """
+    client = get_http_client()
+    try:
+        # Step 1: POST to initiate the call
+        r = await client.post(url, json={"data": [text]}, headers=_deadline_headers(timeout), timeout=timeout)
+        if r.status_code == 404:
+            raise _RouteUnavailable(url)
+        r.raise_for_status()
+        resp = r.json()
+        event_id = resp.get("event_id")
+        if not event_id:
+            print(f"⚠️ No event_id in response from {url}: {resp}")
+            raise _RouteUnavailable(url)
+
+        print(f"  📨 Got event_id={event_id} from {url}")
+
+        # Step 2: stream the result (SSE) and stop at the first terminal event
+        result_url = f"{url}/{event_id}"
+        async with client.stream("GET", result_url, headers=_deadline_headers(timeout), timeout=timeout) as r2:
+            r2.raise_for_status()
+            return await _read_gradio_sse(r2, result_url)
+
+    except _RouteUnavailable:
+        raise
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise _RouteUnavailable(url)
+        print(f"❌ HTTP {e.response.status_code} at {url}: {e}")
+    except httpx.TimeoutException:
+        print(f"⏱️ Timeout at {url}")
+    except Exception as e:
+        print(f"❌ Error calling {url}: {e}")
+
+    return None
+
+
+def _forget_route(base_url: str, route: str) -> None:
+    if _active_routes.get(base_url) == route:
+        _active_routes.pop(base_url, None)
+        print(f"♻️ Forgetting Gradio route {route} for {base_url}: the Space no longer serves it")
+
+
+async def _discover_route(base_url: str, text: str, timeout: float) -> Dict | None:
+    """
+    Probe GRADIO_CALL_ROUTES in order with a real call and remember the first one
+    the Space serves. A route that answers but fails the call (timeout, 5xx, error
+    event) is still remembered, so waiting callers use it instead of probing again.
+    """
+    for route in GRADIO_CALL_ROUTES:
+        url = f"{base_url}{route}"
+        try:
+            parsed = await _call_gradio_route(url, text, timeout)
+        except _RouteUnavailable:
+            print(f"⚠️ 404 at {url}, trying next...")
+            continue
+        _active_routes[base_url] = route
+        print(f"📌 Using Gradio route {route} for {base_url}")
+        return parsed
+    return None
+
+
 async def _call_gradio_api(base_url: str, text: str, timeout: float = 120.0) -> Dict | None:
     """
-    Call Gradio 5.x HTTP API (two-step: POST /call/predict -> GET /call/predict/<event_id>).
+    Call the Space's predict endpoint, reusing the route discovered for base_url.
     Returns parsed {label, score} or None on failure.
     """
-    call_url = f"{base_url}/call/predict"
-    alt_call_url = f"{base_url}/gradio_api/call/predict"
-
-    for url in [call_url, alt_call_url]:
+    route = _active_routes.get(base_url)
+    if route is not None:
         try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                # Step 1: POST to initiate the call
-                r = await client.post(url, json={"data": [text]})
-                if r.status_code == 404:
-                    print(f"⚠️ 404 at {url}, trying next...")
-                    continue
-                r.raise_for_status()
-                resp = r.json()
-                event_id = resp.get("event_id")
-                if not event_id:
-                    print(f"⚠️ No event_id in response from {url}: {resp}")
-                    continue
-
-                print(f"  📨 Got event_id={event_id} from {url}")
-
-                # Step 2: GET the result (SSE stream)
-                result_url = f"{url}/{event_id}"
-                r2 = await client.get(result_url, timeout=timeout)
-                r2.raise_for_status()
-
-                # Parse SSE response - look for "data:" lines with JSON
-                body = r2.text
-                result_data = None
-                for line in body.strip().split("\n"):
-                    line = line.strip()
-                    if line.startswith("data:"):
-                        json_str = line[5:].strip()
-                        if json_str:
-                            import json
-                            try:
-                                result_data = json.loads(json_str)
-                            except json.JSONDecodeError:
-                                continue
-
-                if result_data and isinstance(result_data, list) and len(result_data) > 0:
-                    return _parse_single_result(result_data[0])
-                elif result_data:
-                    return _parse_single_result(result_data)
-
-                print(f"⚠️ Could not parse SSE response from {result_url}: {body[:500]}")
-                return None
+            return await _call_gradio_route(f"{base_url}{route}", text, timeout)
+        except _RouteUnavailable:
+            # Only a 404 / missing event_id means the route is gone; rediscover below.
+            _forget_route(base_url, route)
 
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                print(f"⚠️ 404 at {url}, trying next...")
-                continue
-            print(f"❌ HTTP {e.response.status_code} at {url}: {e}")
-        except httpx.TimeoutException:
-            print(f"⏱️ Timeout at {url}")
+    # Only one caller per Space probes; the others wait and then reuse what it found.
+    lock = _discovery_locks.setdefault(base_url, asyncio.Lock())
+    async with lock:
+        route = _active_routes.get(base_url)
+        if route is None:
+            return await _discover_route(base_url, text, timeout)
+    try:
+        return await _call_gradio_route(f"{base_url}{route}", text, timeout)
+    except _RouteUnavailable:
+        _forget_route(base_url, route)
+        return None
+
+
+def get_active_routes() -> Dict[str, str]:
+    """Gradio route currently used for each Space base URL."""
+    return dict(_active_routes)
+
+
+def _columnar_preds(labels: Any, scores: bytes) -> List[Dict] | None:
+    buf = array("f")
+    buf.frombytes(scores)
+    if sys.byteorder == "big":
+        buf.byteswap()
+    if not isinstance(labels, list) or len(labels) != len(buf):
+        return None
+    # float32 carries ~7 significant digits; drop the noise from widening to float64.
+    return [{"label": label, "score": round(float(score), 6)} for label, score in zip(labels, buf)]
+
+
+def _decode_batch_response(r: httpx.Response) -> List[Dict] | None:
+    """Raw per-text predictions from a /predict response in any supported format."""
+    media_type = r.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+    if media_type == MSGPACK and msgpack is not None:
+        body = msgpack.unpackb(r.content, raw=False)
+        return _columnar_preds(body.get("labels"), body.get("scores") or b"")
+    if media_type == COLUMNAR_JSON:
+        body = r.json()
+        return _columnar_preds(body.get("labels"), base64.b64decode(body.get("scores") or ""))
+    body = r.json()
+    return body.get("preds") if isinstance(body, dict) else None
+
+
+async def _call_batch_api(base_url: str, texts: List[str], timeout: float) -> List[Dict] | None:
+    """
+    Send a chunk to a batch-capable model server (POST /predict {"texts": [...]}).
+    Returns one {label, score} per text, None on failure (including a body that
+    cannot be decoded or has the wrong length), or raises _RouteUnavailable when
+    the backend has no batch endpoint (404 / 405).
+    """
+    url = f"{base_url}/predict"
+    client = get_http_client()
+    try:
+        headers = {**_deadline_headers(timeout), "Accept": PREDICT_ACCEPT}
+        r = None
+        if _wire_formats.get(base_url) == MSGPACK:
+            r = await client.post(
+                url,
+                content=msgpack.packb({"texts": texts}, use_bin_type=True),
+                headers={**headers, "Content-Type": MSGPACK},
+                timeout=timeout,
+            )
+            if r.status_code == 415:
+                # e.g. restarted without msgpack: forget the format and resend this chunk as JSON.
+                print(f"ℹ️ {base_url} no longer accepts msgpack bodies, back to JSON")
+                _wire_formats.pop(base_url, None)
+                r = None
+        if r is None:
+            r = await client.post(url, json={"texts": texts}, headers=headers, timeout=timeout)
+        if r.status_code in (404, 405):
+            raise _RouteUnavailable(url)
+        r.raise_for_status()
+        try:
+            preds = _decode_batch_response(r)
         except Exception as e:
-            print(f"❌ Error calling {url}: {e}")
+            print(f"⚠️ Could not decode /predict response from {url}: {e}")
+            return None
+        if not isinstance(preds, list) or len(preds) != len(texts):
+            count = len(preds) if isinstance(preds, list) else "no"
+            print(f"⚠️ /predict at {url} returned {count} predictions for {len(texts)} texts")
+            return None
+        media_type = r.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+        if media_type in (MSGPACK, COLUMNAR_JSON) and _wire_formats.get(base_url) != media_type:
+            print(f"📦 {base_url} answers /predict as {media_type}")
+            _wire_formats[base_url] = media_type
+        return [_parse_single_result(p) for p in preds]
+
+    except _RouteUnavailable:
+        raise
+    except httpx.HTTPStatusError as e:
+        print(f"❌ HTTP {e.response.status_code} at {url}: {e}")
+    except httpx.TimeoutException:
+        print(f"⏱️ Timeout at {url} for a chunk of {len(texts)} texts")
+    except Exception as e:
+        print(f"❌ Error calling {url}: {e}")
 
     return None
 
 
-async def analyze_texts(texts: List[str]) -> List[Dict]:
-    """Analyze a list of texts for toxicity using the HF Space."""
-    base = (settings.IBTIKAR_URL or DEFAULT_HF_SPACE_URL).strip().rstrip("/")
-    if not base:
-        print("⚠️ No IBTIKAR_URL and default missing")
-        return _stub_only_on_failure(texts)
+# Stay well below SQLite's bound-parameter limit in IN (...) lookups.
+_STORE_LOOKUP_CHUNK = 500
+
+
+def _load_scored_texts(db: Session, keys: List[str]) -> Dict[str, Dict]:
+    """One bulk lookup (chunked for SQLite) of previously scored texts by hash."""
+    found: Dict[str, Dict] = {}
+    unique = list(dict.fromkeys(keys))
+    try:
+        # Savepoint: a failed lookup must not roll back the caller's pending rows.
+        with db.begin_nested():
+            for k in range(0, len(unique), _STORE_LOOKUP_CHUNK):
+                rows = (
+                    db.query(ScoredText)
+                    .filter(ScoredText.text_hash.in_(unique[k:k + _STORE_LOOKUP_CHUNK]))
+                    .all()
+                )
+                for row in rows:
+                    found[row.text_hash] = {"label": row.label, "score": float(row.score)}
+    except SQLAlchemyError as e:
+        print(f"⚠️ scored_texts lookup failed, scoring everything: {e}")
+        found = {}
+    return found
 
+
+def _save_scored_texts(db: Session, scored: Dict[str, Dict], model_id: str) -> None:
+    """Insert or refresh scored_texts rows for freshly scored texts."""
+    if not scored:
+        return
+    try:
+        # Savepoint: the cache is best-effort, so a failed write (e.g. another
+        # worker inserted the same hash first) only undoes its own rows, never
+        # predictions the caller has added but not committed yet.
+        with db.begin_nested():
+            existing = {
+                row.text_hash: row
+                for row in db.query(ScoredText).filter(ScoredText.text_hash.in_(list(scored))).all()
+            }
+            now = datetime.utcnow()
+            for key, pred in scored.items():
+                row = existing.get(key)
+                if row is None:
+                    db.add(ScoredText(
+                        text_hash=key,
+                        label=pred["label"],
+                        score=pred["score"],
+                        model_version=model_id,
+                        scored_at=now,
+                    ))
+                else:
+                    row.label = pred["label"]
+                    row.score = pred["score"]
+                    row.model_version = model_id
+                    row.scored_at = now
+    except SQLAlchemyError as e:
+        print(f"⚠️ Could not save {len(scored)} scored texts: {e}")
+        return
+    try:
+        db.commit()
+    except SQLAlchemyError as e:
+        print(f"⚠️ Could not commit {len(scored)} scored texts: {e}")
+        db.rollback()
+
+
+def _resolve_base_url() -> str:
+    base = (settings.IBTIKAR_URL or DEFAULT_HF_SPACE_URL).strip().rstrip("/")
     # Clean base URL (remove any trailing path fragments)
     for suffix in ["/predict", "/api", "/run", "/call"]:
         if base.endswith(suffix):
             base = base[: -len(suffix)].rstrip("/")
+    return base
+
 
-    print(f"🔍 Calling Gradio 5.x API at {base}/call/predict for {len(texts)} texts...")
+def _get_breaker(base: str) -> CircuitBreaker:
+    breaker = _breakers.get(base)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            failure_threshold=settings.IBTIKAR_BREAKER_FAILURES,
+            cooldown_seconds=settings.IBTIKAR_BREAKER_COOLDOWN,
+        )
+        _breakers[base] = breaker
+    return breaker
 
-    results = []
+
+async def _score_chunk(
+    base: str,
+    pairs: List[Tuple[str, str]],
+    lane: str | None = None,
+    tenant: str | None = None,
+) -> Dict[str, _Outcome] | None:
+    """
+    Score one chunk of (key, text) via the batch endpoint, holding a scheduler slot.
+    Returns None when the chunk should be retried with per-text calls.
+    """
+    async with _scheduler.slot(lane, tenant, cost=len(pairs)):
+        return await _post_chunk(base, pairs)
+
+
+async def _post_chunk(base: str, pairs: List[Tuple[str, str]]) -> Dict[str, _Outcome] | None:
+    """_score_chunk without the slot, for callers that already hold one (micro-batches)."""
+    breaker = _get_breaker(base)
+    if not breaker.allow():
+        return {key: (None, 0.0) for key, _ in pairs}
+    started = time.perf_counter()
+    try:
+        preds = await _call_batch_api(
+            base, [text for _, text in pairs], timeout=settings.IBTIKAR_BATCH_TIMEOUT
+        )
+    except _RouteUnavailable:
+        if base not in _batch_support:
+            print(f"ℹ️ {base} has no batch /predict endpoint, falling back to per-text calls")
+            _batch_support[base] = False
+            return None
+        # Known batch server answering 404/405 (e.g. mid-deploy): a failed chunk.
+        preds = None
+    latency_ms = (time.perf_counter() - started) * 1000.0
+
+    if preds is None:
+        breaker.record_failure()
+        # Only retry per text while we still don't know whether batching works here.
+        if base not in _batch_support:
+            return None
+        return {key: (None, latency_ms) for key, _ in pairs}
+    breaker.record_success()
+    if base not in _batch_support:
+        print(f"📦 {base} accepts batched /predict calls")
+    _batch_support[base] = True
+    return {key: (parsed, latency_ms) for (key, _), parsed in zip(pairs, preds)}
+
+
+def _hedge_delay(base: str) -> float | None:
+    """Seconds to wait before hedging a single call, from the recent latency quantile."""
+    if not settings.IBTIKAR_HEDGE_ENABLED:
+        return None
+    tracker = _latencies.get(base)
+    q = tracker.quantile(settings.IBTIKAR_HEDGE_QUANTILE) if tracker else None
+    if q is None:
+        return None
+    return max(q, settings.IBTIKAR_HEDGE_MIN_DELAY_MS / 1000.0)
+
+
+def _count_hedge(backup_won: bool) -> None:
+    _hedge_stats["won"] += int(backup_won)
+
+
+async def _score_single(base: str, text: str) -> _Outcome:
+    breaker = _get_breaker(base)
+    timeout = settings.IBTIKAR_TIMEOUT
+
+    def _start_backup():
+        # Hedge only into spare capacity, and never while the backend is struggling.
+        if _scheduler.saturated() or breaker.state != "closed":
+            return None
+        _hedge_stats["fired"] += 1
+
+        async def _backup() -> Dict | None:
+            async with _scheduler.slot():
+                return await _call_gradio_api(base, text, timeout=timeout)
+        return _backup
+
+    async with _scheduler.slot():
+        if not breaker.allow():
+            return None, 0.0
+        started = time.perf_counter()
+        parsed = await hedged(
+            lambda: _call_gradio_api(base, text, timeout=timeout),
+            _hedge_delay(base),
+            _start_backup,
+            on_hedge=_count_hedge,
+        )
+        elapsed = time.perf_counter() - started
+
+    if parsed is None:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+        _latencies.setdefault(base, LatencyTracker()).add(elapsed)
+    return parsed, elapsed * 1000.0
+
+
+def _get_batcher(base: str, lane: str) -> MicroBatcher:
+    lanes = _batchers.setdefault(base, {})
+    batcher = lanes.get(lane)
+    if batcher is None:
+        batcher = MicroBatcher(
+            dispatch=lambda pairs: _post_chunk(base, pairs),
+            max_batch=settings.IBTIKAR_MICROBATCH_MAX_ITEMS,
+            max_wait_ms=settings.IBTIKAR_MICROBATCH_WAIT_MS,
+            slot=lambda: _scheduler.slot(lane, BATCH_TENANT),
+            quantum=_scheduler.tenant_quantum,
+            charge=_scheduler.charge,
+        )
+        lanes[lane] = batcher
+    return batcher
+
+
+async def _score_texts(
+    base: str,
+    pairs: List[Tuple[str, str]],
+    on_outcomes: Callable[[Dict[str, _Outcome]], None],
+) -> None:
+    """
+    Score (key, text) pairs in batch chunks when possible, else one call per text.
+    on_outcomes is called as each batch or single call finishes.
+    """
+    async def _singles(todo: List[Tuple[str, str]]) -> None:
+        async def _one(key: str, text: str) -> None:
+            on_outcomes({key: await _score_single(base, text)})
+        await asyncio.gather(*(_one(key, text) for key, text in todo))
+
+    if (
+        settings.IBTIKAR_BATCH_ENABLED
+        and settings.IBTIKAR_MICROBATCH_WAIT_MS > 0
+        and _batch_support.get(base) is True
+    ):
+        # Known batch backend: merge with texts from concurrent requests.
+        async def _item(pair: Tuple[str, str], fut: asyncio.Future) -> None:
+            outcome = await fut
+            if outcome is None:
+                await _singles([pair])
+            else:
+                on_outcomes({pair[0]: outcome})
+        futures = _get_batcher(base, current_lane.get()).enqueue(pairs, current_tenant.get())
+        await asyncio.gather(*(_item(pair, fut) for pair, fut in zip(pairs, futures)))
+    elif settings.IBTIKAR_BATCH_ENABLED and _batch_support.get(base) is not False:
+        async def _chunk(chunk: List[Tuple[str, str]]) -> None:
+            chunk_outcomes = await _score_chunk(base, chunk)
+            if chunk_outcomes is None:
+                await _singles(chunk)
+            else:
+                on_outcomes(chunk_outcomes)
+        size = max(1, settings.IBTIKAR_BATCH_SIZE)
+        await asyncio.gather(*(_chunk(pairs[k:k + size]) for k in range(0, len(pairs), size)))
+    else:
+        await _singles(pairs)
+
+
+class HttpGradioBackend(InferenceBackend):
+    """
+    The HF Space (Gradio) or a standalone ibtikar_api server, reached over HTTP.
+    Uses batch /predict when the server has it, else one Gradio call per text.
+    """
+
+    name = "http_gradio"
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    @property
+    def model_id(self) -> str:
+        return settings.IBTIKAR_MODEL_VERSION or self.base_url
+
+    def describe(self) -> str:
+        if settings.IBTIKAR_BATCH_ENABLED and _batch_support.get(self.base_url) is not False:
+            mode = f"batch /predict (size={max(1, settings.IBTIKAR_BATCH_SIZE)})"
+        else:
+            mode = "Gradio /call/predict"
+        return f"{mode} at {self.base_url} (concurrency={max(1, settings.IBTIKAR_MAX_CONCURRENCY)})"
+
+    async def score(self, pairs: List[Tuple[str, str]], on_outcomes: Callable[[Dict[str, _Outcome]], None]) -> None:
+        await _score_texts(self.base_url, pairs, on_outcomes)
+
+    async def startup(self) -> None:
+        await startup_http_client()
+
+    async def shutdown(self) -> None:
+        await shutdown_http_client()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "gradio_routes": get_active_routes(),
+            "batch_endpoints": dict(_batch_support),
+            "wire_formats": dict(_wire_formats),
+            "microbatch": {
+                base: {lane: b.stats() for lane, b in lanes.items()} for base, lanes in _batchers.items()
+            },
+            "scheduler": _scheduler.stats(),
+            "circuit_breakers": {base: b.stats() for base, b in _breakers.items()},
+            "hedged_requests": dict(_hedge_stats),
+        }
+
+
+def get_backend() -> InferenceBackend | None:
+    """The configured inference backend (IBTIKAR_BACKEND), built on first use."""
+    global _backend
+    if _backend is None:
+        choice = (settings.IBTIKAR_BACKEND or "http_gradio").strip().lower()
+        if choice == "in_process":
+            _backend = InProcessBackend(
+                model_source=settings.IBTIKAR_LOCAL_MODEL,
+                model_version=settings.IBTIKAR_MODEL_VERSION,
+                batch_size=settings.IBTIKAR_BATCH_SIZE,
+                max_wait_ms=settings.IBTIKAR_MICROBATCH_WAIT_MS,
+                num_threads=settings.IBTIKAR_LOCAL_THREADS,
+                # One forward at a time; the next one goes to the highest-priority lane waiting.
+                scheduler=_build_scheduler(1),
+            )
+        else:
+            if choice != "http_gradio":
+                print(f"⚠️ Unknown IBTIKAR_BACKEND={choice!r}, using http_gradio")
+            base = _resolve_base_url()
+            if not base:
+                return None
+            _backend = HttpGradioBackend(base)
+    return _backend
+
+
+async def startup_inference() -> None:
+    backend = get_backend()
+    if backend is not None:
+        print(f"🧩 Inference backend: {backend.describe()}")
+        await backend.startup()
+
+
+async def shutdown_inference() -> None:
+    global _backend
+    if _backend is not None:
+        await _backend.shutdown()
+        _backend = None
+
+
+def get_inference_stats() -> Dict[str, Any]:
+    """Snapshot of the inference client state, shown in /health."""
+    backend = get_backend()
+    return {
+        "backend": backend.name if backend else None,
+        "prediction_cache": _prediction_cache.stats(),
+        "dedup": {
+            **_dedup_stats,
+            "dedup_ratio": round(_dedup_stats["texts"] / _dedup_stats["unique_texts"], 3)
+            if _dedup_stats["unique_texts"] else 1.0,
+        },
+        "inflight_texts": len(_inflight),
+        **(backend.stats() if backend else {}),
+    }
+
+
+async def _run_shared(
+    backend: InferenceBackend,
+    pairs: List[Tuple[str, str]],
+    futures: Dict[str, asyncio.Future],
+    lane: str,
+    tenant: str,
+) -> None:
+    """
+    Score texts on behalf of every caller waiting on `futures` and resolve them
+    as results arrive. Runs as its own task, so a caller going away does not cancel the work.
+    """
+    current_lane.set(lane)
+    current_tenant.set(tenant)
+
+    def _resolve(outcomes: Dict[str, _Outcome]) -> None:
+        for key, outcome in outcomes.items():
+            parsed, _ = outcome
+            if parsed and parsed["label"] in ("harmful", "safe"):
+                _prediction_cache.put(key, {"label": parsed["label"], "score": parsed["score"]})
+            fut = futures.get(key)
+            if fut is not None and not fut.done():
+                fut.set_result(outcome)
+
+    try:
+        await backend.score(pairs, _resolve)
+        for fut in futures.values():
+            if not fut.done():
+                fut.set_result((None, 0.0))
+    except asyncio.CancelledError:
+        for fut in futures.values():
+            fut.cancel()
+        raise
+    except Exception as e:
+        print(f"❌ Scoring {len(pairs)} texts failed: {e}")
+        for fut in futures.values():
+            if not fut.done():
+                fut.set_exception(e)
+    finally:
+        for key, fut in futures.items():
+            if _inflight.get(key, (None,))[0] is fut:
+                del _inflight[key]
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _mark_retrieved(fut: asyncio.Future) -> None:
+    # Nobody may be left to await a failed shared future; avoid "never retrieved" warnings.
+    if not fut.cancelled():
+        fut.exception()
+
+
+def _future_outcome(fut: asyncio.Future) -> _Outcome:
+    if fut.cancelled() or fut.exception() is not None:
+        return None, 0.0
+    return fut.result()
+
+
+def _record_dedup(texts: int, unique: int) -> None:
+    _dedup_stats["calls"] += 1
+    _dedup_stats["texts"] += texts
+    _dedup_stats["unique_texts"] += unique
+
+
+def _outcome_to_result(parsed: Dict | None, latency_ms: float) -> Dict:
+    if parsed:
+        return {**parsed, "latency_ms": latency_ms}
+    return {"label": "unknown", "score": 0.0, "latency_ms": latency_ms}
+
+
+async def _finish_late(
+    late: Dict[str, asyncio.Future],
+    indices: Dict[str, List[int]],
+    model_id: str,
+    on_late_results: Callable[[Dict[int, Dict]], None] | None,
+) -> None:
+    """Wait for texts that missed the caller's deadline, then persist and report them."""
+    await asyncio.wait(set(late.values()))
+    results: Dict[int, Dict] = {}
+    fresh: Dict[str, Dict] = {}
+    for key, fut in late.items():
+        parsed, latency_ms = _future_outcome(fut)
+        result = _outcome_to_result(parsed, latency_ms)
+        if result["label"] in ("harmful", "safe"):
+            fresh[key] = {"label": result["label"], "score": result["score"]}
+        for i in indices[key]:
+            results[i] = result
+    print(f"⌛ {len(fresh)} of {len(late)} late texts scored in the background")
+
+    if fresh:
+        db = SessionLocal()
+        try:
+            _save_scored_texts(db, fresh, model_id)
+        finally:
+            db.close()
+    if on_late_results is not None:
+        try:
+            on_late_results(results)
+        except Exception as e:
+            print(f"❌ Applying late results failed: {e}")
+
+
+async def iter_analyze_texts(
+    texts: List[str],
+    db: Session | None = None,
+    deadline: float | None = None,
+    on_late_results: Callable[[Dict[int, Dict]], None] | None = None,
+    priority: str = "interactive",
+    tenant: int | str | None = None,
+) -> AsyncIterator[Tuple[int, Dict]]:
+    """
+    Score texts with the configured backend (IBTIKAR_BACKEND) and yield
+    (index, {label, score, ...}) as each result becomes available:
+    empty and cached texts first, then model results in completion order.
+    Duplicates (same normalized text) are scored once and share the result.
+    With a db session, texts already in scored_texts are reused and new scores are saved there.
+    Identical texts already being scored for another caller are awaited, not sent again,
+    unless that work is queued in a lower-priority lane than this call's.
+
+    `deadline` is a time.monotonic() timestamp. Texts not scored by then are yielded as
+    {"label": "pending"} and keep running in the background; once they finish,
+    on_late_results({index: {label, score, ...}}) is called.
+
+    `priority` is the scheduling lane for model calls: "interactive" for a user
+    waiting on the response, "background" for bulk work. `tenant` (the user_id)
+    gets a fair share of model calls within that lane.
+    """
+    backend = get_backend()
+    if backend is None:
+        print("⚠️ No IBTIKAR_URL and default missing")
+        for i, r in enumerate(_stub_only_on_failure(texts)):
+            yield i, r
+        return
+
+    print(f"🔍 Scoring {len(texts)} texts with {backend.describe()}...")
+
+    model_id = backend.model_id
+    counts = {"harmful": 0, "safe": 0, "unknown": 0, "pending": 0}
+
+    def _count(result: Dict) -> Dict:
+        label = result["label"]
+        counts[label if label in counts else "unknown"] += 1
+        return result
+
+    # Collapse duplicates (same normalized text) up front: every lookup and model
+    # call below is per unique text, and results fan back out to all positions.
+    indices: Dict[str, List[int]] = {}
     for i, text in enumerate(texts):
         if not text or not text.strip():
-            results.append({"label": "safe", "score": 0.5})
+            yield i, _count({"label": "safe", "score": 0.5})
             continue
+        indices.setdefault(text_cache_key(text, model_id), []).append(i)
+    non_empty = sum(len(idx) for idx in indices.values())
+    _record_dedup(non_empty, len(indices))
+    if len(indices) < non_empty:
+        print(
+            f"🧬 {non_empty - len(indices)} duplicate texts collapsed: {len(indices)} unique of {non_empty} "
+            f"(dedup ratio {non_empty / len(indices):.2f}x)"
+        )
 
-        parsed = await _call_gradio_api(base, text, timeout=120.0)
-        if parsed:
-            results.append(parsed)
-            print(f"  ✅ Text {i+1}/{len(texts)}: label={parsed['label']} score={parsed['score']:.3f}")
-        else:
-            results.append({"label": "unknown", "score": 0.0})
-            print(f"  ❌ Text {i+1}/{len(texts)}: failed, marking unknown")
+    todo: List[str] = []
+    for key, idx in indices.items():
+        cached = _prediction_cache.get(key)
+        if cached is None:
+            todo.append(key)
+            continue
+        for i in idx:
+            yield i, _count({**cached, "cached": True})
+    if db is not None and todo:
+        stored = _load_scored_texts(db, todo)
+        still_todo = []
+        for key in todo:
+            hit = stored.get(key)
+            if hit is None:
+                still_todo.append(key)
+                continue
+            _prediction_cache.put(key, hit)
+            for i in indices[key]:
+                yield i, _count({**hit, "cached": True})
+        todo = still_todo
+    if len(todo) < len(indices):
+        print(f"💾 {len(indices) - len(todo)} of {len(indices)} unique texts answered without calling the model")
+
+    # Single-flight: join work already in flight for a key, otherwise own it. Work in
+    # a lower-priority lane is not joined (an interactive caller would wait behind
+    # the bulk job); this call scores the text itself and later callers join that.
+    lane = lane_of(priority)
+    loop = asyncio.get_running_loop()
+    waits: Dict[str, asyncio.Future] = {}
+    owned: List[Tuple[str, str]] = []
+    outranked = 0
+    for key in todo:
+        fut, fut_lane = _inflight.get(key, (None, lane))
+        if fut is not None and LANES.index(fut_lane) > LANES.index(lane):
+            outranked += 1
+            fut = None
+        if fut is None:
+            fut = loop.create_future()
+            fut.add_done_callback(_mark_retrieved)
+            _inflight[key] = (fut, lane)
+            owned.append((key, texts[indices[key][0]]))
+        waits[key] = fut
+    joined = len(waits) - len(owned)
+    if joined:
+        print(f"🔗 {joined} texts are already being scored for another request, sharing that work")
+    if outranked:
+        print(f"⏫ {outranked} texts are in flight as lower-priority work, scoring them again as {lane}")
+    if owned:
+        _spawn(_run_shared(
+            backend,
+            owned,
+            {key: waits[key] for key, _ in owned},
+            lane,
+            str(tenant) if tenant is not None else "anonymous",
+        ))
 
-    harmful = sum(1 for r in results if r["label"] == "harmful")
-    safe = sum(1 for r in results if r["label"] == "safe")
-    unknown = sum(1 for r in results if r["label"] == "unknown")
-    print(f"📊 Results: {harmful} harmful, {safe} safe, {unknown} unknown out of {len(texts)}")
+    # asyncio.wait() never cancels what it waits on, so neither a caller going
+    # away nor the deadline cancels the shared work.
+    key_of = {fut: key for key, fut in waits.items()}
+    remaining = set(waits.values())
+    fresh: Dict[str, Dict] = {}
+    while remaining:
+        budget = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, remaining = await asyncio.wait(
+            remaining, timeout=budget, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            break
+        for fut in done:
+            key = key_of[fut]
+            parsed, latency_ms = _future_outcome(fut)
+            result = _outcome_to_result(parsed, latency_ms)
+            if parsed and parsed["label"] in ("harmful", "safe"):
+                fresh[key] = {"label": parsed["label"], "score": parsed["score"]}
+            for i in indices[key]:
+                if parsed:
+                    print(f"  ✅ Text {i+1}/{len(texts)}: label={parsed['label']} score={parsed['score']:.3f} ({latency_ms:.0f} ms)")
+                else:
+                    print(f"  ❌ Text {i+1}/{len(texts)}: failed after {latency_ms:.0f} ms, marking unknown")
+                yield i, _count(dict(result))
 
-    return results
\ No newline at end of file
+    if db is not None:
+        _save_scored_texts(db, fresh, model_id)
+    if remaining:
+        late = {key_of[fut]: fut for fut in remaining}
+        print(f"⏳ Deadline reached, {len(late)} texts left pending and finishing in the background")
+        for key in late:
+            for i in indices[key]:
+                yield i, _count({"label": "pending", "score": 0.0})
+        # Spawned only after the caller has consumed every pending item, so it can
+        # store them before on_late_results runs.
+        _spawn(_finish_late(late, {key: indices[key] for key in late}, model_id, on_late_results))
+
+    print(
+        f"📊 Results: {counts['harmful']} harmful, {counts['safe']} safe, {counts['unknown']} unknown, "
+        f"{counts['pending']} pending out of {len(texts)}"
+    )
+
+
+async def analyze_texts(
+    texts: List[str],
+    db: Session | None = None,
+    deadline: float | None = None,
+    on_late_results: Callable[[Dict[int, Dict]], None] | None = None,
+    priority: str = "interactive",
+    tenant: int | str | None = None,
+) -> List[Dict]:
+    """
+    Analyze a list of texts for toxicity; results are in input order.
+    See iter_analyze_texts for caching, deadline and pending semantics.
+    """
+    results: List[Dict | None] = [None] * len(texts)
+    async for i, result in iter_analyze_texts(texts, db, deadline, on_late_results, priority, tenant):
+        results[i] = result
+    return results
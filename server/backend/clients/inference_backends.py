@@ -0,0 +1,192 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from .microbatch import MicroBatcher
+from .scheduler import BATCH_TENANT, LANES, LaneScheduler, current_lane, current_tenant
+
+# Parsed {label, score} (None on failure) and the call latency in ms.
+Outcome = Tuple[Dict | None, float]
+OnOutcomes = Callable[[Dict[str, Outcome]], None]
+
+# Same model the standalone IbtikarAI/ibtikar_api.py serves.
+DEFAULT_LOCAL_MODEL_DIR = Path(__file__).resolve().parents[2] / "IbtikarAI" / "arabert_toxic_classifier"
+
+
+class InferenceBackend(ABC):
+    """
+    Where analyze_texts sends texts that missed every cache.
+    Implementations score (cache key, text) pairs and report outcomes as they finish.
+    """
+
+    name = "base"
+
+    @property
+    @abstractmethod
+    def model_id(self) -> str:
+        """Identifies the model in cache keys; changing it invalidates cached scores."""
+
+    def describe(self) -> str:
+        return self.name
+
+    @abstractmethod
+    async def score(self, pairs: List[Tuple[str, str]], on_outcomes: OnOutcomes) -> None:
+        """Score the pairs, calling on_outcomes as results arrive."""
+
+    async def startup(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InProcessBackend(InferenceBackend):
+    """
+    Runs the AraBERT classifier inside the API process.
+    The model is loaded once and every forward runs on one dedicated thread,
+    so the event loop is never blocked; texts from concurrent requests are
+    micro-batched into shared forwards.
+    """
+
+    name = "in_process"
+
+    def __init__(
+        self,
+        model_source: str | None,
+        model_version: str | None,
+        batch_size: int,
+        max_wait_ms: float,
+        num_threads: int = 0,
+        max_length: int = 128,
+        scheduler: LaneScheduler | None = None,
+    ):
+        self.model_source = model_source or str(DEFAULT_LOCAL_MODEL_DIR)
+        self._model_version = model_version
+        self.batch_size = max(1, int(batch_size))
+        self.num_threads = int(num_threads)
+        self.max_length = max_length
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ibtikar-model")
+        self._scheduler = scheduler or LaneScheduler(slots=1, weights={}, max_wait=10.0)
+        self._batchers = {
+            lane: MicroBatcher(
+                self._dispatch,
+                max_batch=self.batch_size,
+                max_wait_ms=max_wait_ms,
+                slot=lambda lane=lane: self._scheduler.slot(lane, BATCH_TENANT),
+                quantum=self._scheduler.tenant_quantum,
+                charge=self._scheduler.charge,
+            )
+            for lane in LANES
+        }
+        self._tokenizer = None
+        self._model = None
+        self._toxic_index = 1
+        self.forwards = 0
+        self.forward_seconds = 0.0
+
+    @property
+    def model_id(self) -> str:
+        return self._model_version or f"in_process:{self.model_source}"
+
+    def describe(self) -> str:
+        return f"in-process model {self.model_source}"
+
+    # ---- runs on the model thread ----
+
+    def _load(self) -> None:
+        if self._model is not None:
+            return
+        try:
+            import torch
+            from transformers import AutoTokenizer, AutoModelForSequenceClassification
+        except ImportError as e:
+            raise RuntimeError(
+                "IBTIKAR_BACKEND=in_process needs torch and transformers installed"
+            ) from e
+
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        print(f"🧠 Loading in-process model from {self.model_source}...")
+        started = time.perf_counter()
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_source)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_source)
+        model.eval()
+
+        # Same rule as ibtikar_api.py: the label containing "toxic", else index 1.
+        for i, label in (model.config.id2label or {}).items():
+            if "toxic" in str(label).lower():
+                self._toxic_index = int(i)
+                break
+        self._model = model
+        print(f"🧠 Model loaded in {time.perf_counter() - started:.1f}s")
+
+    def _forward(self, texts: List[str]) -> List[Dict]:
+        import torch
+
+        self._load()
+        enc = self._tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        started = time.perf_counter()
+        with torch.no_grad():
+            probs = self._model(**enc).logits.softmax(dim=-1)
+        self.forwards += 1
+        self.forward_seconds += time.perf_counter() - started
+
+        preds = []
+        for p in probs:
+            toxic_prob = float(p[self._toxic_index])
+            preds.append({"label": "harmful" if toxic_prob >= 0.5 else "safe", "score": toxic_prob})
+        return preds
+
+    # ---- event loop side ----
+
+    async def _dispatch(self, pairs: List[Tuple[str, str]]) -> Dict[str, Outcome]:
+        # Runs inside the batch's scheduler slot (see MicroBatcher).
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            preds = await loop.run_in_executor(self._executor, self._forward, [t for _, t in pairs])
+        except Exception as e:
+            print(f"❌ In-process forward over {len(pairs)} texts failed: {e}")
+            preds = [None] * len(pairs)
+        latency_ms = (time.perf_counter() - started) * 1000.0
+        return {key: (pred, latency_ms) for (key, _), pred in zip(pairs, preds)}
+
+    async def score(self, pairs: List[Tuple[str, str]], on_outcomes: OnOutcomes) -> None:
+        async def _item(pair: Tuple[str, str], fut: asyncio.Future) -> None:
+            outcome = await fut
+            on_outcomes({pair[0]: outcome if outcome is not None else (None, 0.0)})
+
+        futures = self._batchers[current_lane.get()].enqueue(pairs, current_tenant.get())
+        await asyncio.gather(*(_item(pair, fut) for pair, fut in zip(pairs, futures)))
+
+    async def startup(self) -> None:
+        # Load before the first request instead of during it.
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._load)
+        except Exception as e:
+            print(f"❌ Could not load in-process model: {e}")
+
+    async def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model_source": self.model_source,
+            "loaded": self._model is not None,
+            "forwards": self.forwards,
+            "avg_forward_ms": round(self.forward_seconds / self.forwards * 1000.0, 2) if self.forwards else 0.0,
+            "microbatch": {lane: b.stats() for lane, b in self._batchers.items()},
+            "scheduler": self._scheduler.stats(),
+        }
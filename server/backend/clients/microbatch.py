@@ -0,0 +1,171 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+# (cache key, text) -> outcome the dispatcher returned for it, or None to fall back
+Pair = Tuple[str, str]
+Dispatch = Callable[[List[Pair]], Awaitable[Optional[Dict[str, Any]]]]
+
+# One queued text: (pair, future, queued_at)
+_Item = Tuple[Pair, asyncio.Future, float]
+
+
+class MicroBatcher:
+    """
+    Cross-request micro-batching for a batch-capable model backend.
+    Texts submitted by concurrent callers are held for up to `max_wait_ms`
+    (or until `max_batch` items are queued) and sent as one batch; each
+    caller gets back only the outcomes for its own texts.
+
+    Texts wait in one queue per tenant. A batch is only formed once `slot()`
+    has been acquired for it, taking up to `max_batch` texts from the tenant
+    queues by deficit round-robin (`quantum(tenant)` texts per turn), so a
+    tenant with a large backlog cannot fill every batch ahead of one that
+    arrived later. `charge(tenant, texts, waited)` is called for each tenant
+    in a batch.
+    """
+
+    def __init__(
+        self,
+        dispatch: Dispatch,
+        max_batch: int,
+        max_wait_ms: float,
+        slot: Callable[[], AsyncContextManager[None]] | None = None,
+        quantum: Callable[[str], int] | None = None,
+        charge: Callable[[str, int, float], None] | None = None,
+    ):
+        self._dispatch = dispatch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._slot = slot or nullcontext  # no slot: batches run as soon as they are formed
+        self._quantum = quantum or (lambda tenant: self.max_batch)
+        self._charge = charge
+        self._queues: Dict[str, Deque[_Item]] = {}
+        self._ring: Deque[str] = deque()  # tenants with queued texts, in service order
+        self._deficit: Dict[str, int] = {}
+        self._depth = 0
+        self._claimed = 0  # texts reserved by batches still waiting for a slot
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+        # metrics
+        self.batches = 0
+        self.items = 0
+        self.max_queue_depth = 0
+        self._total_wait = 0.0
+
+    def enqueue(self, pairs: List[Pair], tenant: str = "anonymous") -> List[asyncio.Future]:
+        """Queue pairs for the next batches; each future resolves to that pair's outcome (or None)."""
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(tenant)
+        if queue is None:
+            queue = self._queues[tenant] = deque()
+            self._deficit[tenant] = 0
+            self._ring.append(tenant)
+        futures = []
+        now = time.perf_counter()
+        for pair in pairs:
+            fut = loop.create_future()
+            queue.append((pair, fut, now))
+            futures.append(fut)
+        self._depth += len(pairs)
+        self.max_queue_depth = max(self.max_queue_depth, self._depth)
+        self._schedule()
+        return futures
+
+    def _schedule(self) -> None:
+        # A full batch's worth of unclaimed texts goes now; a remainder waits for the timer.
+        while self._depth - self._claimed >= self.max_batch:
+            self._start(self.max_batch)
+        if self._depth > self._claimed:
+            if self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush_remainder)
+        elif self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _flush_remainder(self) -> None:
+        self._timer = None
+        if self._depth > self._claimed:
+            self._start(self._depth - self._claimed)
+
+    def _start(self, claim: int) -> None:
+        self._claimed += claim
+        task = asyncio.get_running_loop().create_task(self._run(claim))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self, n: int) -> List[Tuple[str, _Item]]:
+        """Up to n queued texts by deficit round-robin over tenants."""
+        taken: List[Tuple[str, _Item]] = []
+        while len(taken) < n and self._ring:
+            tenant = self._ring[0]
+            queue = self._queues[tenant]
+            if self._deficit[tenant] <= 0:
+                self._deficit[tenant] += max(1, int(self._quantum(tenant)))
+            k = min(self._deficit[tenant], n - len(taken), len(queue))
+            for _ in range(k):
+                taken.append((tenant, queue.popleft()))
+            self._deficit[tenant] -= k
+            if not queue:
+                del self._queues[tenant]
+                del self._deficit[tenant]
+                self._ring.popleft()
+            elif self._deficit[tenant] <= 0:
+                self._ring.rotate(-1)
+        self._depth -= len(taken)
+        return taken
+
+    async def _run(self, claim: int) -> None:
+        try:
+            async with self._slot():
+                self._claimed -= claim
+                claim = 0
+                taken = self._take(self.max_batch)
+                # Texts that arrived while this batch waited may need a timer of their own.
+                self._schedule()
+                if taken:
+                    await self._run_batch(taken)
+        finally:
+            self._claimed -= claim
+
+    async def _run_batch(self, taken: List[Tuple[str, _Item]]) -> None:
+        started = time.perf_counter()
+        self.batches += 1
+        self.items += len(taken)
+        per_tenant: Dict[str, List[float]] = {}
+        for tenant, (_, _, queued_at) in taken:
+            per_tenant.setdefault(tenant, []).append(started - queued_at)
+        self._total_wait += sum(sum(w) for w in per_tenant.values())
+        if self._charge is not None:
+            for tenant, waits in per_tenant.items():
+                self._charge(tenant, len(waits), sum(waits) / len(waits))
+
+        items = [item for _, item in taken if not item[1].done()]
+        if not items:
+            return
+        try:
+            outcomes = await self._dispatch([pair for pair, _, _ in items])
+        except Exception as e:
+            for _, fut, _ in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (key, _), fut, _ in items:
+            if not fut.done():
+                fut.set_result(None if outcomes is None else outcomes.get(key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._depth,
+            "queued_tenants": len(self._queues),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "avg_queue_wait_ms": round(self._total_wait / self.items * 1000.0, 2) if self.items else 0.0,
+        }
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one inference backend.
+    closed -> open after `failure_threshold` failures in a row; open fails fast
+    for `cooldown_seconds`, then half_open lets one probe call through.
+    A successful probe closes the circuit, a failed one re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown_seconds = float(cooldown_seconds)
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open" and now - self._opened_at >= self.cooldown_seconds:
+            self.state = "half_open"
+            self._probe_started = None
+        if self.state == "closed":
+            return True
+        if self.state == "half_open":
+            # One probe at a time; a probe that never reported back expires after a cool-down.
+            if self._probe_started is None or now - self._probe_started >= self.cooldown_seconds:
+                self._probe_started = now
+                return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            print("✅ Inference circuit closed again")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+        ):
+            print(
+                f"🚫 Inference circuit open after {self.consecutive_failures} failures, "
+                f"failing fast for {self.cooldown_seconds:g}s"
+            )
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probe_started = None
+            self.times_opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies (seconds) for quantile estimates."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples: Deque[float] = deque(maxlen=max(1, int(window)))
+        self.min_samples = min_samples
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def hedged(
+    make_call: Callable[[], Awaitable[Optional[T]]],
+    delay: Optional[float],
+    start_backup: Callable[[], Optional[Callable[[], Awaitable[Optional[T]]]]],
+    on_hedge: Callable[[bool], None] = lambda won: None,
+) -> Optional[T]:
+    """
+    Run make_call(); if it has not finished after `delay` seconds, ask start_backup()
+    for a duplicate call (it may decline by returning None) and return the first
+    non-None result. The loser is cancelled. on_hedge(backup_won) reports hedges.
+    """
+    primary = asyncio.ensure_future(make_call())
+    tasks = {primary}
+    try:
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        backup_call = None if done else start_backup()
+        if backup_call is None:
+            return await primary
+
+        backup = asyncio.ensure_future(backup_call())
+        tasks.add(backup)
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if not t.cancelled() and t.exception() is None and t.result() is not None:
+                    on_hedge(t is backup)
+                    return t.result()
+        on_hedge(False)
+        return None
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
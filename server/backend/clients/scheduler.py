@@ -0,0 +1,326 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from .resilience import LatencyTracker
+
+# Priority lanes, highest first. Interactive = a user waiting on a response.
+LANES = ("interactive", "background")
+
+# Lane and tenant (user_id) of the inference work started from the current task
+# (see iter_analyze_texts).
+current_lane: ContextVar[str] = ContextVar("ibtikar_lane", default="interactive")
+current_tenant: ContextVar[str] = ContextVar("ibtikar_tenant", default="anonymous")
+
+# Slot holder for micro-batches, which mix texts from several tenants; the batcher
+# shares each batch out between tenants itself and charges them through charge().
+BATCH_TENANT = "(micro-batch)"
+
+# Per-tenant stats are dropped after this long without activity.
+TENANT_IDLE_SECONDS = 300.0
+
+# One queued acquire: (future, queued_at, cost)
+_Waiter = Tuple[asyncio.Future, float, int]
+
+
+class _Lane:
+    """Waiters of one lane, queued per tenant and served by deficit round-robin."""
+
+    def __init__(self):
+        self.queues: Dict[str, Deque[_Waiter]] = {}
+        self.ring: Deque[str] = deque()  # tenants with waiters, in service order
+        self.deficit: Dict[str, int] = {}
+        self.max_depth = 0
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def oldest(self) -> Optional[float]:
+        heads = [q[0][1] for q in self.queues.values() if q]
+        return min(heads) if heads else None
+
+    def push(self, tenant: str, waiter: _Waiter, quantum: int) -> None:
+        queue = self.queues.get(tenant)
+        if not queue:
+            queue = self.queues[tenant] = deque()
+            # Credited on its turn, or right away when it is the only tenant waiting.
+            self.deficit[tenant] = 0 if self.ring else quantum
+            self.ring.append(tenant)
+        queue.append(waiter)
+        self.max_depth = max(self.max_depth, self.depth())
+
+    def remove(self, tenant: str, waiter: _Waiter) -> None:
+        queue = self.queues.get(tenant)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            self._drop(tenant)
+
+    def _drop(self, tenant: str) -> None:
+        del self.queues[tenant]
+        self.deficit.pop(tenant, None)
+        try:
+            self.ring.remove(tenant)
+        except ValueError:
+            pass
+
+    def pop(self, quantum: Callable[[str], int], capped: Callable[[str], bool]) -> Optional[Tuple[str, _Waiter]]:
+        """Next waiter by deficit round-robin, skipping tenants at their slot cap."""
+        skipped = 0
+        while self.ring:
+            tenant = self.ring[0]
+            queue = self.queues[tenant]
+            if capped(tenant):
+                skipped += 1
+                if skipped >= len(self.ring):
+                    return None
+            else:
+                skipped = 0
+                cost = queue[0][2]
+                if self.deficit[tenant] >= cost:
+                    self.deficit[tenant] -= cost
+                    waiter = queue.popleft()
+                    if not queue:
+                        self._drop(tenant)
+                    return tenant, waiter
+            # Turn over: the next tenant that can be served gets its quantum.
+            self.ring.rotate(-1)
+            nxt = self.ring[0]
+            if not capped(nxt):
+                self.deficit[nxt] += quantum(nxt)
+        return None
+
+
+class _TenantStats:
+    def __init__(self):
+        self.in_use = 0
+        self.granted = 0
+        self.granted_cost = 0
+        self.total_wait = 0.0
+        self.recent: Deque[Tuple[float, int]] = deque()  # (granted_at, cost) over the last minute
+        self.last_active = time.monotonic()
+
+    def record(self, cost: int, waited: float) -> None:
+        now = time.monotonic()
+        self.last_active = now
+        self.granted += 1
+        self.granted_cost += cost
+        self.total_wait += waited
+        self.recent.append((now, cost))
+        while self.recent and now - self.recent[0][0] > 60.0:
+            self.recent.popleft()
+
+    def per_minute(self) -> int:
+        now = time.monotonic()
+        return sum(cost for at, cost in self.recent if now - at <= 60.0)
+
+
+class LaneScheduler:
+    """
+    Hands out a fixed number of inference slots to priority lanes and,
+    within a lane, to tenants.
+
+    Lanes: while several lanes have waiters, each lane gets up to
+    `weights[lane]` slots per round, higher lanes first (weight 0 = only when
+    the lanes above are idle). A waiter older than `max_wait` seconds is
+    served next whatever its lane, so background work cannot starve.
+
+    Tenants: deficit round-robin on cost (texts per call). Each turn a tenant
+    earns `quantum * tenant_weights[tenant]`; a tenant holding
+    `tenant_max_slots` slots waits for one of them to be released (0 = no cap).
+    Micro-batches hold their slot as BATCH_TENANT: the batcher shares each batch
+    between tenants by the same quanta and reports their texts through charge().
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        weights: Dict[str, int],
+        max_wait: float,
+        quantum: int = 16,
+        tenant_weights: Dict[str, int] | None = None,
+        tenant_max_slots: int = 0,
+    ):
+        self.slots = max(1, int(slots))
+        self.weights = {lane: max(0, int(weights.get(lane, 1))) for lane in LANES}
+        self.max_wait = float(max_wait)
+        self.quantum = max(1, int(quantum))
+        self.tenant_weights = {str(t): max(1, int(w)) for t, w in (tenant_weights or {}).items()}
+        self.tenant_max_slots = max(0, int(tenant_max_slots))
+        self._free = self.slots
+        self._lanes: Dict[str, _Lane] = {lane: _Lane() for lane in LANES}
+        self._credits = dict(self.weights)
+        self._tenants: Dict[str, _TenantStats] = {}
+        self._pruned_at = time.monotonic()
+
+        # metrics
+        self._granted = {lane: 0 for lane in LANES}
+        self._aged = {lane: 0 for lane in LANES}
+        self._waits = {lane: LatencyTracker(window=500, min_samples=1) for lane in LANES}
+        self._total_wait = {lane: 0.0 for lane in LANES}
+
+    def saturated(self) -> bool:
+        return self._free <= 0
+
+    @asynccontextmanager
+    async def slot(self, lane: Optional[str] = None, tenant: Optional[str] = None, cost: int = 1) -> AsyncIterator[None]:
+        """Hold one slot for the duration of the block; lane and tenant default to the context vars."""
+        tenant = str(tenant) if tenant is not None else current_tenant.get()
+        await self.acquire(lane or current_lane.get(), tenant, cost)
+        try:
+            yield
+        finally:
+            self.release(tenant)
+
+    def tenant_quantum(self, tenant: str) -> int:
+        return self.quantum * self.tenant_weights.get(tenant, 1)
+
+    def _capped(self, tenant: str) -> bool:
+        stats = self._tenants.get(tenant)
+        return bool(self.tenant_max_slots) and stats is not None and stats.in_use >= self.tenant_max_slots
+
+    async def acquire(self, lane: str, tenant: str, cost: int = 1) -> None:
+        if lane not in self._lanes:
+            lane = LANES[-1]
+        cost = max(1, int(cost))
+        self._prune()
+        self._tenants.setdefault(tenant, _TenantStats())
+        if self._free > 0 and not any(l.ring for l in self._lanes.values()) and not self._capped(tenant):
+            self._take(lane, tenant, cost, 0.0)
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        waiter = (fut, time.monotonic(), cost)
+        self._lanes[lane].push(tenant, waiter, self.tenant_quantum(tenant))
+        # Slots may be free while every other waiter's tenant is at its cap.
+        self._grant()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted just as we were cancelled: hand the slot on.
+                self.release(tenant)
+            else:
+                self._lanes[lane].remove(tenant, waiter)
+            raise
+
+    def charge(self, tenant: str, cost: int, waited: float) -> None:
+        """Record `cost` texts served for a tenant inside a slot held by BATCH_TENANT."""
+        self._tenants.setdefault(str(tenant), _TenantStats()).record(max(1, int(cost)), waited)
+
+    def _prune(self) -> None:
+        """Forget stats of tenants idle for TENANT_IDLE_SECONDS, so user_ids seen once don't pile up."""
+        now = time.monotonic()
+        if now - self._pruned_at < 60.0:
+            return
+        self._pruned_at = now
+        queued = {t for lane in self._lanes.values() for t in lane.queues}
+        for tenant in [
+            t for t, stats in self._tenants.items()
+            if stats.in_use == 0 and t not in queued and now - stats.last_active >= TENANT_IDLE_SECONDS
+        ]:
+            del self._tenants[tenant]
+
+    def release(self, tenant: str) -> None:
+        self._free += 1
+        self._tenants[tenant].in_use -= 1
+        self._grant()
+
+    def _take(self, lane: str, tenant: str, cost: int, waited: float) -> None:
+        self._free -= 1
+        self._tenants[tenant].in_use += 1
+        self._tenants[tenant].record(cost, waited)
+        self._granted[lane] += 1
+        self._total_wait[lane] += waited
+        self._waits[lane].add(waited)
+
+    def _grant(self) -> None:
+        blocked = set()  # lanes whose waiting tenants are all at their cap
+        while self._free > 0:
+            lane = self._pick(blocked)
+            if lane is None:
+                return
+            picked = self._lanes[lane].pop(self.tenant_quantum, self._capped)
+            if picked is None:
+                blocked.add(lane)
+                continue
+            tenant, (fut, queued_at, cost) = picked
+            if fut.done():
+                continue
+            self._take(lane, tenant, cost, time.monotonic() - queued_at)
+            fut.set_result(None)
+
+    def _pick(self, blocked: set) -> Optional[str]:
+        waiting = [lane for lane in LANES if self._lanes[lane].ring and lane not in blocked]
+        if not waiting:
+            return None
+
+        # Starvation guard: the lane with the oldest waiter past max_wait goes first.
+        now = time.monotonic()
+        oldest = min(waiting, key=lambda lane: self._lanes[lane].oldest())
+        if now - self._lanes[oldest].oldest() >= self.max_wait:
+            if oldest != waiting[0]:
+                self._aged[oldest] += 1
+            return oldest
+
+        for _ in range(2):
+            for lane in waiting:
+                if self._credits[lane] > 0:
+                    self._credits[lane] -= 1
+                    return lane
+            # Every waiting lane used its share this round: start a new one.
+            self._credits = dict(self.weights)
+        return waiting[0]
+
+    def stats(self) -> Dict[str, Any]:
+        lanes: Dict[str, Any] = {}
+        for lane in LANES:
+            granted = self._granted[lane]
+            p95 = self._waits[lane].quantile(0.95)
+            lanes[lane] = {
+                "weight": self.weights[lane],
+                "queue_depth": self._lanes[lane].depth(),
+                "max_queue_depth": self._lanes[lane].max_depth,
+                "granted": granted,
+                "starvation_promotions": self._aged[lane],
+                "avg_wait_ms": round(self._total_wait[lane] / granted * 1000.0, 2) if granted else 0.0,
+                "p95_wait_ms": round(p95 * 1000.0, 2) if p95 is not None else 0.0,
+            }
+        tenants: Dict[str, Any] = {}
+        for tenant, t in self._tenants.items():
+            if tenant == BATCH_TENANT:
+                continue
+            queued = [w for l in self._lanes.values() for w in l.queues.get(tenant, ())]
+            tenants[tenant] = {
+                "weight": self.tenant_weights.get(tenant, 1),
+                "backlog_calls": len(queued),
+                "backlog_texts": sum(cost for _, _, cost in queued),
+                "in_use": t.in_use,
+                "granted_calls": t.granted,
+                "granted_texts": t.granted_cost,
+                "texts_last_minute": t.per_minute(),
+                "avg_wait_ms": round(t.total_wait / t.granted * 1000.0, 2) if t.granted else 0.0,
+            }
+        return {
+            "slots": self.slots,
+            "in_use": self.slots - self._free,
+            "max_wait_seconds": self.max_wait,
+            "tenant_quantum": self.quantum,
+            "tenant_max_slots": self.tenant_max_slots,
+            "lanes": lanes,
+            "tenants": tenants,
+        }
+
+
+def lane_of(name: Optional[str]) -> str:
+    """Normalize a caller-supplied priority to a known lane (unknown -> lowest)."""
+    if name in LANES:
+        return name
+    return LANES[-1]
@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from pydantic import AnyUrl
 from functools import lru_cache
+from typing import Dict
 
 class Settings(BaseSettings):
     ENV: str = "dev"
@@ -22,7 +23,42 @@ class Settings(BaseSettings):
         extra = "ignore"
 
     # --- IbtikarAI ---
+    IBTIKAR_BACKEND: str = "http_gradio"    # "http_gradio" | "in_process"
     IBTIKAR_URL: str | None = None
+    IBTIKAR_TIMEOUT: float = 120.0          # seconds per Space call
+    IBTIKAR_MAX_CONCURRENCY: int = 4        # max in-flight Space calls per process
+    IBTIKAR_HTTP_MAX_CONNECTIONS: int = 20
+    IBTIKAR_HTTP_MAX_KEEPALIVE: int = 10
+    IBTIKAR_HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    IBTIKAR_HTTP2: bool = False             # needs the optional 'h2' package
+    IBTIKAR_BATCH_ENABLED: bool = True      # probe for a batch /predict endpoint
+    IBTIKAR_BATCH_SIZE: int = 16            # texts per batch call
+    IBTIKAR_BATCH_TIMEOUT: float = 30.0     # seconds per batch call
+    IBTIKAR_MICROBATCH_WAIT_MS: float = 5.0  # hold texts this long to merge requests; 0 disables
+    IBTIKAR_MICROBATCH_MAX_ITEMS: int = 32  # dispatch as soon as this many texts are queued
+    IBTIKAR_BREAKER_FAILURES: int = 5       # consecutive failures before failing fast
+    IBTIKAR_BREAKER_COOLDOWN: float = 30.0  # seconds before a half-open probe
+    IBTIKAR_HEDGE_ENABLED: bool = False     # duplicate slow single-text calls
+    IBTIKAR_HEDGE_QUANTILE: float = 0.95    # hedge after this latency quantile...
+    IBTIKAR_HEDGE_MIN_DELAY_MS: float = 500.0  # ...but never sooner than this
+    IBTIKAR_INTERACTIVE_WEIGHT: int = 4     # inference slots per round for interactive requests...
+    IBTIKAR_BACKGROUND_WEIGHT: int = 1      # ...and for background jobs (0 = only when interactive is idle)
+    IBTIKAR_LANE_MAX_WAIT: float = 10.0     # seconds a queued call may wait before it is served regardless of lane
+    IBTIKAR_TENANT_QUANTUM: int = 16        # texts each user_id may send per round-robin turn
+    IBTIKAR_TENANT_WEIGHTS: Dict[str, int] = {}  # user_id -> weight (quantum multiplier), JSON e.g. {"12": 4}
+    IBTIKAR_TENANT_MAX_SLOTS: int = 0       # inference slots one user_id may hold at once (0 = no cap)
+    IBTIKAR_MODEL_VERSION: str | None = None  # part of cache keys; defaults to the base URL
+    IBTIKAR_LOCAL_MODEL: str | None = None  # in_process: model dir or HF id (default IbtikarAI/arabert_toxic_classifier)
+    IBTIKAR_LOCAL_THREADS: int = 0          # in_process: torch intra-op threads, 0 = torch default
+
+    # --- Analysis ---
+    ANALYSIS_PREVIEW_DEADLINE: float = 25.0  # seconds before /v1/analysis/preview returns partial results
+    JOBS_MAX_WORKERS: int = 2               # analysis jobs running at once
+    JOBS_MAX_QUEUED: int = 100              # waiting jobs before POST /v1/analysis/jobs returns 429
+
+    # --- Prediction cache ---
+    PREDICTION_CACHE_SIZE: int = 10000      # entries; 0 disables the cache
+    PREDICTION_CACHE_TTL_SECONDS: float = 86400.0
 
 
 @lru_cache(maxsize=1)
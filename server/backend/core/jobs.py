@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+class JobQueue:
+    """
+    Bounded pool of asyncio workers running background jobs by id.
+    At most `workers` jobs run at once and at most `max_queued` wait;
+    job state itself lives in the database, the queue only holds ids.
+    """
+
+    def __init__(self, runner: Callable[[str], Awaitable[None]], workers: int, max_queued: int):
+        self._runner = runner
+        self.workers = max(1, int(workers))
+        self.max_queued = max(1, int(max_queued))
+        self._queue: asyncio.Queue | None = None
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = 0
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_id: str) -> bool:
+        """
+        Queue a job id; False when the queue is full (or the pool is not started).
+        Call from the event loop thread only: asyncio.Queue is not thread-safe.
+        """
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self.running += 1
+            try:
+                await self._runner(job_id)
+            except Exception as e:
+                print(f"❌ Job worker {n}: job {job_id} crashed: {e}")
+            finally:
+                self.running -= 1
+                self.completed += 1
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+        }
@@ -1,6 +1,13 @@
+import hashlib
+import re
+import unicodedata
 from typing import Dict, List
 from .schemas import PostIn
 
+_RT_PREFIX = re.compile(r"^RT @\w+:\s*")
+_WHITESPACE = re.compile(r"\s+")
+
+
 def x_tweets_to_posts(payload: Dict) -> List[PostIn]:
     data = payload.get("data", []) or []
     out: List[PostIn] = []
@@ -13,3 +20,16 @@ def x_tweets_to_posts(payload: Dict) -> List[PostIn]:
             created_at=t.get("created_at"),
         ))
     return out
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used to recognise repeated texts (reposts, copy-paste spam)."""
+    s = unicodedata.normalize("NFKC", text or "")
+    s = _RT_PREFIX.sub("", s.strip())
+    return _WHITESPACE.sub(" ", s).strip()
+
+
+def text_cache_key(text: str, model_id: str) -> str:
+    """Stable hash of (model, normalized text) for prediction caches."""
+    raw = f"{model_id}\n{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
@@ -11,7 +11,7 @@ class PostIn(BaseModel):
 
 class AnalysisItem(BaseModel):
     post: PostIn
-    label: str                  # "harmful" | "safe" | "unknown"
+    label: str                  # "harmful" | "safe" | "unknown" | "pending"
     score: float = 0.0          # 0..1
 
 class AnalysisResponse(BaseModel):
@@ -19,3 +19,4 @@ class AnalysisResponse(BaseModel):
     harmful_count: int = Field(0)
     safe_count:   int = 0
     unknown_count:int = 0
+    pending_count:int = 0       # still being scored after the deadline
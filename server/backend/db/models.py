@@ -116,3 +116,70 @@ class Prediction(Base):
             f"source={self.source!r} post_id={self.post_id!r} "
             f"label={self.label!r} score={self.score}>"
         )
+
+
+class ScoredText(Base):
+    """
+    Model output per distinct text, shared by every user.
+    analyze_texts looks texts up here before calling the model, so a tweet
+    seen by many NGO accounts is only scored once.
+    """
+
+    __tablename__ = "scored_texts"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    # text_cache_key(): sha256 of model id + normalized text
+    text_hash = Column(String(64), nullable=False, unique=True, index=True)
+
+    label = Column(String, nullable=False)  # "harmful" / "safe"
+    score = Column(Float, nullable=False)
+
+    # Which model produced it (IBTIKAR_MODEL_VERSION or the inference base URL)
+    model_version = Column(String, nullable=False)
+
+    scored_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return (
+            f"<ScoredText id={self.id} text_hash={self.text_hash[:12]!r} "
+            f"label={self.label!r} score={self.score}>"
+        )
+
+
+class AnalysisJob(Base):
+    """
+    One background fetch -> classify -> persist run.
+    Created by POST /v1/analysis/jobs and polled via GET /v1/analysis/jobs/{id};
+    queued/running jobs are picked up again after a restart.
+    """
+
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+
+    # "queued" / "running" / "succeeded" / "failed"
+    status = Column(String, nullable=False, default="queued", index=True)
+
+    # Request parameters
+    authors_limit = Column(Integer, nullable=False)
+    per_batch = Column(Integer, nullable=False)
+
+    # Progress and results
+    total = Column(Integer, nullable=True)  # posts fetched, known once fetch finishes
+    processed = Column(Integer, nullable=False, default=0)
+    harmful_count = Column(Integer, nullable=False, default=0)
+    safe_count = Column(Integer, nullable=False, default=0)
+    unknown_count = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+    # Timings
+    fetch_ms = Column(Integer, nullable=True)
+    analyze_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<AnalysisJob id={self.id!r} user_id={self.user_id} status={self.status!r}>"
@@ -0,0 +1,12 @@
+import os
+import tempfile
+from pathlib import Path
+
+# Settings are read at import time; give the required ones test values before
+# anything under backend/ is imported.
+os.environ.setdefault("X_CLIENT_ID", "test")
+os.environ.setdefault("X_CLIENT_SECRET", "test")
+os.environ.setdefault("X_REDIRECT_URI", "http://localhost/callback")
+os.environ.setdefault("FERNET_KEY", "")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.mkdtemp()) / 'test.sqlite3'}")
+
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+import pytest
+
+from backend.clients import ibtikar_client
+from backend.clients.inference_backends import InferenceBackend
+from backend.clients.scheduler import current_lane
+from backend.db.init_db import init_db
+from backend.db.models import ScoredText
+from backend.db.session import SessionLocal
+
+
+class FakeBackend(InferenceBackend):
+    """Labels texts containing "bad" harmful; texts in `gates` wait for their event."""
+
+    name = "fake"
+
+    def __init__(self):
+        self.calls: List[List[str]] = []
+        self.lanes: List[str] = []
+        self.gates: Dict[str, asyncio.Event] = {}
+
+    @property
+    def model_id(self) -> str:
+        return "fake-model"
+
+    async def score(self, pairs: List[Tuple[str, str]], on_outcomes) -> None:
+        self.calls.append([text for _, text in pairs])
+        self.lanes.append(current_lane.get())
+
+        async def _one(key: str, text: str, gate: asyncio.Event | None) -> None:
+            if gate is not None:
+                await gate.wait()
+            label = "harmful" if "bad" in text else "safe"
+            on_outcomes({key: ({"label": label, "score": 0.9 if label == "harmful" else 0.1}, 1.0)})
+
+        await asyncio.gather(*(_one(key, text, self.gates.get(text)) for key, text in pairs))
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    fake = FakeBackend()
+    monkeypatch.setattr(ibtikar_client, "_backend", fake)
+    ibtikar_client._prediction_cache.clear()
+    ibtikar_client._inflight.clear()
+    return fake
+
+
+async def _collect(texts, **kwargs) -> Dict[int, Dict]:
+    return {i: r async for i, r in ibtikar_client.iter_analyze_texts(texts, **kwargs)}
+
+
+def test_duplicates_are_scored_once_and_fanned_out(backend):
+    texts = ["bad words", "hello", "bad words", "", "hello", "bad words"]
+
+    results = asyncio.run(_collect(texts))
+
+    assert backend.calls == [["bad words", "hello"]]
+    assert [results[i]["label"] for i in range(len(texts))] == [
+        "harmful", "safe", "harmful", "safe", "safe", "harmful",
+    ]
+
+
+def test_caller_going_away_does_not_cancel_shared_work(backend):
+    async def main():
+        backend.gates["bad slow"] = asyncio.Event()
+        first = asyncio.create_task(_collect(["bad slow"]))
+        await asyncio.sleep(0)  # first caller owns the in-flight text
+        second = asyncio.create_task(_collect(["bad slow"]))
+        await asyncio.sleep(0)
+        first.cancel()
+        backend.gates["bad slow"].set()
+        return await second, first
+
+    second, first = asyncio.run(main())
+
+    assert first.cancelled()
+    assert second[0]["label"] == "harmful"
+    assert backend.calls == [["bad slow"]]
+    assert not ibtikar_client._inflight
+
+
+def test_interactive_caller_does_not_wait_on_background_work(backend):
+    async def main():
+        gate = backend.gates["bad shared"] = asyncio.Event()
+        job = asyncio.create_task(_collect(["bad shared"], priority="background"))
+        while not backend.calls:
+            await asyncio.sleep(0)
+        del backend.gates["bad shared"]  # only the background call is held back
+
+        preview = await asyncio.wait_for(_collect(["bad shared"], priority="interactive"), timeout=5)
+        assert not job.done()
+        # A later interactive caller joins the interactive work, not the background one.
+        again = await _collect(["bad shared"], priority="interactive")
+        gate.set()
+        return preview, again, await job
+
+    preview, again, job = asyncio.run(main())
+
+    assert preview[0]["label"] == again[0]["label"] == job[0]["label"] == "harmful"
+    assert backend.lanes == ["background", "interactive"]
+    assert not ibtikar_client._inflight
+
+
+def test_texts_past_the_deadline_are_pending_then_reported_late(backend):
+    init_db()
+    late: Dict[int, Dict] = {}
+
+    async def main():
+        backend.gates["bad late"] = asyncio.Event()
+        reported = asyncio.Event()
+
+        def on_late_results(results):
+            late.update(results)
+            reported.set()
+
+        results = await _collect(
+            ["ok", "bad late", "bad late"],
+            deadline=time.monotonic() + 0.05,
+            on_late_results=on_late_results,
+        )
+        assert not reported.is_set()
+        backend.gates["bad late"].set()
+        await asyncio.wait_for(reported.wait(), timeout=5)
+        return results
+
+    results = asyncio.run(main())
+
+    assert results[0]["label"] == "safe"
+    assert results[1]["label"] == results[2]["label"] == "pending"
+    assert set(late) == {1, 2}
+    assert late[1]["label"] == late[2]["label"] == "harmful"
+
+    # The late score is stored, so other workers reuse it instead of calling the model.
+    key = ibtikar_client.text_cache_key("bad late", backend.model_id)
+    db = SessionLocal()
+    try:
+        assert db.query(ScoredText).filter(ScoredText.text_hash == key).one().label == "harmful"
+    finally:
+        db.close()
@@ -0,0 +1,144 @@
+import asyncio
+import importlib.util
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import pytest
+
+API_DIR = Path(__file__).resolve().parents[1] / "IbtikarAI"
+
+
+def _fake_transformers() -> types.ModuleType:
+    """Just enough of transformers for ibtikar_api to import without a model."""
+
+    class Tokenizer:
+        def __call__(self, texts, truncation=True, max_length=128):
+            ids = [[1] * min(max_length, len(t.split()) + 2) for t in texts]
+            return {"input_ids": ids, "attention_mask": ids}
+
+    class Model:
+        config = types.SimpleNamespace(id2label={0: "normal", 1: "toxic"})
+
+        def eval(self):
+            pass
+
+    module = types.ModuleType("transformers")
+    module.AutoTokenizer = types.SimpleNamespace(from_pretrained=lambda source: Tokenizer())
+    module.AutoConfig = types.SimpleNamespace(from_pretrained=lambda source: Model.config)
+    module.AutoModelForSequenceClassification = types.SimpleNamespace(from_pretrained=lambda source: Model())
+    return module
+
+
+@pytest.fixture(scope="module")
+def api_module():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("IBTIKAR_ENGINE", "torch")
+        mp.setenv("IBTIKAR_QUANTIZE", "")
+        mp.setitem(sys.modules, "transformers", _fake_transformers())
+        mp.setitem(sys.modules, "torch", types.ModuleType("torch"))
+        spec = importlib.util.spec_from_file_location("ibtikar_api", API_DIR / "ibtikar_api.py")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def api(api_module, monkeypatch):
+    """ibtikar_api with a stub forward that scores every text 0.8 and records batch sizes."""
+    batches = []
+
+    def forward_probs(features):
+        batches.append(len(features["input_ids"]))
+        return [[0.2, 0.8] for _ in features["input_ids"]]
+
+    monkeypatch.setattr(api_module, "forward_probs", forward_probs)
+    # The shutdown hook closes the executor; each test gets a fresh one.
+    monkeypatch.setattr(api_module, "_model_executor", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(api_module, "dropped", {k: 0 for k in api_module.dropped})
+    api_module._pending.clear()
+    monkeypatch.setattr(api_module, "test_batches", batches, raising=False)
+    return api_module
+
+
+def _serve(api, scenario):
+    """Run scenario(client) against the app with its startup/shutdown hooks."""
+    async def main():
+        async with api.app.router.lifespan_context(api.app):
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+                return await scenario(client)
+
+    return asyncio.run(main())
+
+
+def test_full_batch_is_dispatched_without_waiting(api, monkeypatch):
+    monkeypatch.setattr(api, "MAX_BATCH", 4)
+    monkeypatch.setattr(api, "MAX_WAIT_MS", 5000)
+
+    async def scenario(client):
+        first = asyncio.create_task(client.post("/predict", json={"texts": ["one"]}))
+        await asyncio.sleep(0.05)  # the worker is now waiting for more texts
+        rest = await client.post("/predict", json={"texts": ["two", "three", "four"]})
+        return await first, rest
+
+    started = time.perf_counter()
+    first, rest = _serve(api, scenario)
+
+    assert time.perf_counter() - started < 2.0
+    assert first.status_code == rest.status_code == 200
+    assert [p["label"] for p in rest.json()["preds"]] == ["harmful"] * 3
+    assert api.test_batches == [4]
+
+
+def test_request_larger_than_the_queue_is_rejected(api, monkeypatch):
+    monkeypatch.setattr(api, "MAX_QUEUE", 2)
+
+    async def scenario(client):
+        return await client.post("/predict", json={"texts": ["a", "b", "c"]})
+
+    assert _serve(api, scenario).status_code == 413
+    assert api.test_batches == []
+
+
+def test_full_queue_answers_503_with_retry_after(api, monkeypatch):
+    monkeypatch.setattr(api, "MAX_QUEUE", 4)
+    monkeypatch.setattr(api, "MAX_WAIT_MS", 300)
+
+    async def scenario(client):
+        waiting = asyncio.create_task(client.post("/predict", json={"texts": ["a", "b"]}))
+        await asyncio.sleep(0.05)  # two texts queued, batch window still open
+        rejected = await client.post("/predict", json={"texts": ["c", "d", "e"]})
+        return rejected, await waiting
+
+    rejected, waiting = _serve(api, scenario)
+
+    assert rejected.status_code == 503
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert api.dropped["queue_full"] == 3
+    assert waiting.status_code == 200
+
+
+def test_deadline_already_passed_is_rejected_on_arrival(api):
+    async def scenario(client):
+        headers = {"X-Ibtikar-Deadline": f"{time.time() - 1:.3f}"}
+        return await client.post("/predict", json={"texts": ["a", "b"]}, headers=headers)
+
+    assert _serve(api, scenario).status_code == 504
+    assert api.dropped["expired_on_arrival"] == 2
+    assert api.test_batches == []
+
+
+def test_deadline_passing_in_the_queue_skips_the_forward(api, monkeypatch):
+    monkeypatch.setattr(api, "MAX_WAIT_MS", 300)
+
+    async def scenario(client):
+        headers = {"X-Ibtikar-Deadline": f"{time.time() + 0.05:.3f}"}
+        return await client.post("/predict", json={"texts": ["a"]}, headers=headers)
+
+    assert _serve(api, scenario).status_code == 504
+    assert api.dropped["expired_in_queue"] == 1
+    assert api.test_batches == []
@@ -0,0 +1,163 @@
+import asyncio
+import types
+
+import pytest
+
+from backend.clients import resilience
+from backend.clients.resilience import CircuitBreaker, hedged
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = types.SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(resilience, "time", types.SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+def _open(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # resets the streak
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.stats()["times_opened"] == 1
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=30)
+    _open(breaker)
+
+    clock.t += 29
+    assert not breaker.allow()
+    clock.t += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # only one probe at a time
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=30)
+    _open(breaker)
+    clock.t += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.stats()["times_opened"] == 2
+    clock.t += 29
+    assert not breaker.allow()
+    clock.t += 1
+    assert breaker.allow()
+
+
+def test_breaker_probe_that_never_reports_expires(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30)
+    _open(breaker)
+    clock.t += 30
+    assert breaker.allow()  # probe started, never reports back
+
+    clock.t += 29
+    assert not breaker.allow()
+    clock.t += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+
+
+class _Call:
+    """A call that returns `result` once released."""
+
+    def __init__(self, result):
+        self.result = result
+        self.release = asyncio.Event()
+        self.started = False
+        self.cancelled = False
+
+    async def __call__(self):
+        self.started = True
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self.result
+
+
+def _run_hedged(primary_result, backup_result, finish_first, decline=False):
+    """Run hedged() with delay 0; `finish_first` ("primary"/"backup"/"both") is released first."""
+    hedges = []
+
+    async def main():
+        primary, backup = _Call(primary_result), _Call(backup_result)
+        task = asyncio.ensure_future(hedged(
+            primary,
+            delay=0,
+            start_backup=lambda: None if decline else backup,
+            on_hedge=hedges.append,
+        ))
+        await asyncio.sleep(0.01)
+        if finish_first in ("primary", "both"):
+            primary.release.set()
+        if finish_first in ("backup", "both"):
+            backup.release.set()
+        return await task, primary, backup
+
+    result, primary, backup = asyncio.run(main())
+    return result, primary, backup, hedges
+
+
+def test_hedged_without_delay_never_starts_a_backup():
+    started = []
+
+    async def main():
+        async def call():
+            return "primary"
+
+        return await hedged(call, None, lambda: started.append(1), lambda won: started.append(won))
+
+    assert asyncio.run(main()) == "primary"
+    assert started == []
+
+
+def test_hedged_backup_declined_waits_for_primary():
+    result, _, backup, hedges = _run_hedged("primary", "backup", "primary", decline=True)
+    assert result == "primary"
+    assert not backup.started
+    assert hedges == []
+
+
+def test_hedged_primary_wins_and_backup_is_cancelled():
+    result, _, backup, hedges = _run_hedged("primary", "backup", "primary")
+    assert result == "primary"
+    assert backup.cancelled
+    assert hedges == [False]
+
+
+def test_hedged_backup_wins_and_primary_is_cancelled():
+    result, primary, _, hedges = _run_hedged("primary", "backup", "backup")
+    assert result == "backup"
+    assert primary.cancelled
+    assert hedges == [True]
+
+
+def test_hedged_both_fail():
+    result, _, _, hedges = _run_hedged(None, None, "both")
+    assert result is None
+    assert hedges == [False]
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import types
+
+from backend.clients import scheduler
+from backend.clients.inference_backends import InProcessBackend
+from backend.clients.scheduler import TENANT_IDLE_SECONDS, LaneScheduler, current_tenant
+
+
+def _backend() -> InProcessBackend:
+    backend = InProcessBackend(
+        model_source="unused",
+        model_version="test",
+        batch_size=16,
+        max_wait_ms=5,
+        scheduler=LaneScheduler(slots=1, weights={}, max_wait=10.0, quantum=16),
+    )
+    backend.forward_sizes = []
+
+    def forward(texts):
+        backend.forward_sizes.append(len(texts))
+        time.sleep(0.001 * len(texts))
+        return [{"label": "safe", "score": 0.1} for _ in texts]
+
+    backend._forward = forward
+    return backend
+
+
+def test_small_tenant_is_not_queued_behind_large_tenant_batches():
+    backend = _backend()
+    finished = {}
+
+    async def run(tenant, n):
+        current_tenant.set(tenant)
+        pairs = [(f"{tenant}-{i}", f"text {i}") for i in range(n)]
+        await backend.score(pairs, lambda outcomes: None)
+        finished[tenant] = time.perf_counter()
+
+    async def main():
+        big = asyncio.create_task(run("A", 200))
+        await asyncio.sleep(0.01)  # A's backlog is queued first
+        await asyncio.gather(big, run("B", 2))
+        await backend.shutdown()
+
+    asyncio.run(main())
+
+    assert finished["B"] < finished["A"]
+    tenants = backend.stats()["scheduler"]["tenants"]
+    assert tenants["A"]["granted_texts"] == 200
+    assert tenants["B"]["granted_texts"] == 2
+    # B's texts rode along in a batch with A's instead of waiting for A's backlog.
+    assert sum(backend.forward_sizes) == 202
+    assert all(size <= 16 for size in backend.forward_sizes)
+
+
+def test_small_batches_from_different_tenants_share_a_forward():
+    backend = _backend()
+
+    async def run(tenant):
+        current_tenant.set(tenant)
+        await backend.score([(f"{tenant}-{i}", f"text {i}") for i in range(3)], lambda outcomes: None)
+
+    async def main():
+        await asyncio.gather(*(run(f"user{n}") for n in range(5)))
+        await backend.shutdown()
+
+    asyncio.run(main())
+
+    assert backend.forward_sizes == [15]
+    tenants = backend.stats()["scheduler"]["tenants"]
+    assert {t: s["granted_texts"] for t, s in tenants.items()} == {f"user{n}": 3 for n in range(5)}
+
+
+def test_idle_tenants_are_forgotten(monkeypatch):
+    clock = types.SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(scheduler, "time", types.SimpleNamespace(monotonic=lambda: clock.t))
+    lanes = LaneScheduler(slots=1, weights={}, max_wait=10.0)
+    lanes.charge("seen-once", 3, 0.0)
+    clock.t += TENANT_IDLE_SECONDS
+
+    async def main():
+        async with lanes.slot("interactive", "active"):
+            pass
+
+    asyncio.run(main())
+
+    assert set(lanes.stats()["tenants"]) == {"active"}